@@ -1,317 +1,316 @@
 from openai import OpenAI
 
-from functions import *
+from functions import available_functions, condense_tool_output, replace_file, tool_schemas, CACHE_DIR
 
+import io
 import os
+import sys
 import time
 import json
 import venv
+import hashlib
+import argparse
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from typing_extensions import override
-from openai import AssistantEventHandler
+from openai import AssistantEventHandler, NotFoundError
 
 # For Debugging reasons
 DEBUG = False
 
 # Tools
-tools = [
-    {
-        "type": "code_interpreter",
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "copy_file",
-            "description": """Copy a file from any location to another directory.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "file_name": {
-                        "type": "string",
-                        "description": """The file name. This should contain the full path of the file.""",
-                    },
-                    "directory": {
-                        "type": "string",
-                        "description": "The directory to copy the file into.",
-                    },
-                },
-                "required": ["file_name", "directory"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "write_file",
-            "description": """Create and write a file for the user in the language specified as an argument.
-            The extension of the file name must match the language that you are writing in.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "language": {
-                        "type": "string",
-                        "description": """The language of the file. This could be any one of, but not limited to,
-                        Python, CSS, Javascript, C++, or text.""",
-                    },
-                    "file_name": {
-                        "type": "string",
-                        "description": """The file name. This should be prefaced by the same directory
-                        that the rest of the project is being built in. If there is no current project
-                        being worked on, then default to beginning the file name with 'auto/'.""",
-                    },
-                    "file_contents": {
-                        "type": "string",
-                        "description": "The contents of the Python file.",
-                    },
-                },
-                "required": ["language", "file_name", "file_contents"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "run_python_script",
-            "description": """Runs a Python script using the virtual environment directory supplied.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "file_name": {
-                        "type": "string",
-                        "description": """The full path of the Python file to be run.""",
-                    },
-                    "directory": {
-                        "type": "string",
-                        "description": """The directory that you can find the virtual environment in.""",
-                    },
-                    "arguments": {
-                        "type": "array",
-                        "description": """A list of arguments to pass into the Python script.""",
-                        "items": {
-                            "type": "string",
-                        },
-                    },
-                },
-                "required": ["file_name", "directory"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "open_png_file",
-            "description": """Opens a png file.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "file_name": {
-                        "type": "string",
-                        "description": """The full path of the png file to be opened.""",
-                    },
-                },
-                "required": ["file_name"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "create_project_directory",
-            "description": """Create a project directory for a web application. The directory should always start with
-            'auto/' and end with a suffix that briefly describes the coding project in CamelCase.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "directory": {
-                        "type": "string",
-                        "description": """The directory in which the code development will take place. Please preface
-                        this directory with 'auto/' and end with a suffix that briefly describes the coding project in
-                        CamelCase.""",
-                    },
-                },
-                "required": ["directory"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "initialize_react_app",
-            "description": """Initializes a vanilla React app with Chakra UI for frontend components in the project
-            directory specified.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "directory": {
-                        "type": "string",
-                        "description": """The directory in which the code development will take place.""",
-                    },
-                },
-                "required": ["directory"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "deploy_app_to_netlify",
-            "description": """Deploys the React app to netlify. On a successful function call, please display the
-            Website URL for the user to access the application online.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "directory": {
-                        "type": "string",
-                        "description": """The project directory. This should never have '/my-app' as a suffix.""",
-                    },
-                },
-                "required": ["directory"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "redeploy_app_to_netlify",
-            "description": """Re-deploy the React app to netlify. Only call if the web app has already been deployed
-            to netlify on a previous call. On a successful function call, please display the website URL for the user
-            to access the web app online.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "directory": {
-                        "type": "string",
-                        "description": """The project directory. This should never have '/my-app' as a suffix.""",
-                    },
-                },
-                "required": ["directory"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "create_virtual_env",
-            "description": """Create a Python virtual environment for future code development.
-            Please include contents for any requirements file that will be installed using pip.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "directory": {
-                        "type": "string",
-                        "description": """The directory in which the code development will take place. Please preface
-                        this directory with 'auto/' and end with a suffix that briefly describes the coding project.""",
-                    },
-                    "requirements_content": {
-                        "type": "string",
-                        "description": """The contents of the requirements.txt file that will be called
-                        during a pip install command.""",
-                    },
-                },
-                "required": ["directory", "requirements_content"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "search_google",
-            "description": """Make a google search.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": """The query to search.""",
-                    },
-                },
-                "required": ["query"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "search_website",
-            "description": """Search a website to get relevant information.""",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "url": {
-                        "type": "string",
-                        "description": """The URL of the website to search.""",
-                    },
-                },
-                "required": ["url"],
-            },
-        },
-    },
-]
+tools = [{"type": "code_interpreter"}] + list(tool_schemas.values())
+
+
+# Tool calls requested in the same turn run concurrently on a bounded pool
+MAX_TOOL_WORKERS = 4
+tool_executor = ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS, thread_name_prefix="tool")
+
+# Tools that touch npm, pip or netlify state in a project directory. At most
+# one of these may run per directory at a time.
+PROJECT_LOCKED_TOOLS = {
+    "create_virtual_env",
+    "initialize_react_app",
+    "deploy_app_to_netlify",
+    "redeploy_app_to_netlify",
+}
+project_locks = {}
+project_locks_guard = threading.Lock()
+
+
+def get_tool_lock(function_name, function_arguments):
+    # Returns the lock serializing this call, or None if it may run freely
+    if function_name not in PROJECT_LOCKED_TOOLS:
+        return None
+    # Keyed like group_tool_calls, so "auto/X" and its absolute path share a lock
+    directory = os.path.abspath(function_arguments.get("directory", ""))
+    with project_locks_guard:
+        return project_locks.setdefault(directory, threading.Lock())
+
+
+def call_tool(function_name, function_arguments):
+    function_to_call = available_functions[function_name]
+    lock = get_tool_lock(function_name, function_arguments)
+    if lock is None:
+        function_response = function_to_call(function_arguments)
+    else:
+        with lock:
+            function_response = function_to_call(function_arguments)
+    # Keep long logs and pages from slowing down every later turn
+    return condense_tool_output(function_name, function_response)
+
+
+def call_tool_safely(function_name, function_arguments):
+    # A failing tool becomes an error the model can read instead of ending
+    # the session
+    try:
+        return call_tool(function_name, function_arguments)
+    except Exception as e:
+        return json.dumps({"error": f"{function_name} failed: {e}"})
+
+
+def tool_paths(function_arguments):
+    # The files and directories a call works on
+    paths = [function_arguments.get("directory"), function_arguments.get("file_name")]
+    for file in function_arguments.get("files") or []:
+        if isinstance(file, dict):
+            paths.append(file.get("file_name"))
+    return {os.path.abspath(path) for path in paths if isinstance(path, str) and path}
+
+
+def paths_overlap(first, second):
+    return first == second or first.startswith(second + os.sep) or second.startswith(first + os.sep)
+
+
+def group_tool_calls(calls):
+    # Splits (function name, arguments) calls into groups of indexes. Calls
+    # touching the same file or a directory containing it, like a venv and
+    # a script run in it, share a group and keep the model's order. Groups
+    # are independent of each other.
+    groups = []
+    for index, (_, function_arguments) in enumerate(calls):
+        paths = tool_paths(function_arguments)
+        group = (paths, [])
+        for other in [other for other in groups if any(paths_overlap(a, b) for a in paths for b in other[0])]:
+            groups.remove(other)
+            group[0].update(other[0])
+            group[1].extend(other[1])
+        group[1].sort()
+        group[1].append(index)
+        groups.append(group)
+    return [indexes for _, indexes in groups]
+
+
+def parse_tool_calls(tool_calls):
+    # Returns (tool call id, function name, arguments or None if unreadable)
+    calls = []
+    for tool_call in tool_calls:
+        if tool_call.type == "function":
+            try:
+                function_arguments = json.loads(tool_call.function.arguments)
+            except ValueError:
+                function_arguments = None
+            calls.append((tool_call.id, tool_call.function.name, function_arguments))
+    return calls
+
+
+def run_tool_group(calls):
+    outputs = []
+    for function_name, function_arguments in calls:
+        if function_arguments is None:
+            outputs.append(json.dumps({"error": f"The arguments for {function_name} are not valid JSON"}))
+        else:
+            outputs.append(call_tool_safely(function_name, function_arguments))
+    return outputs
+
+
+def run_tool_calls(tool_calls):
+    # Independent groups of calls run concurrently, then the results are
+    # collected in the order the model asked for them
+    calls = parse_tool_calls(tool_calls)
+    groups = group_tool_calls([(name, arguments or {}) for _, name, arguments in calls])
+    futures = []
+    for indexes in groups:
+        future = tool_executor.submit(run_tool_group, [calls[index][1:] for index in indexes])
+        futures.append((indexes, future))
+    outputs = {}
+    for indexes, future in futures:
+        outputs.update(zip(indexes, future.result()))
+    return [
+        {"tool_call_id": tool_call_id, "output": json.dumps(outputs[index])}
+        for index, (tool_call_id, _, _) in enumerate(calls)
+    ]
+
+
+# Deltas are written out at most this many times a second
+RENDER_FPS = float(os.environ.get("RENDER_FPS", "30"))
+
+
+class Renderer:
+    # Collects what the event handler shows and writes it in batches, at
+    # most fps times a second, instead of one flushed print per delta. Other
+    # events and the first delta after them are written at once, so the
+    # first token of a reply is never held back. When json_lines is set, as it is
+    # by default when the output is not a terminal, each event is written as
+    # a JSON object on its own line with consecutive deltas merged.
+    def __init__(self, stream=None, fps=RENDER_FPS, json_lines=None):
+        self.stream = stream or sys.stdout
+        self.interval = 1 / fps
+        self.json_lines = not self.stream.isatty() if json_lines is None else json_lines
+        self.pending = []
+        self.last_flush = 0
+        # Whether the last event written was a delta
+        self.streaming = False
+        self.condition = threading.Condition()
+        self.flusher = None
+
+    def emit(self, event, text, delta=False, **fields):
+        with self.condition:
+            if not self.json_lines:
+                self.pending.append(text)
+            elif delta and self.pending and self.pending[-1]["event"] == event:
+                self.pending[-1]["value"] += text
+            else:
+                self.pending.append({"event": event, "value": text, **fields} if delta else {"event": event, **fields})
+            # The first delta after any other event, like the first token of
+            # a reply, is written at once
+            if not delta or not self.streaming or time.monotonic() - self.last_flush >= self.interval:
+                self.flush_pending()
+                self.streaming = delta
+            elif self.flusher is None:
+                self.flusher = threading.Thread(target=self.flush_frames, name="renderer", daemon=True)
+                self.flusher.start()
+            else:
+                self.condition.notify()
+
+    def flush(self):
+        with self.condition:
+            self.flush_pending()
+
+    def flush_pending(self):
+        # Called with the condition held
+        if self.pending:
+            if self.json_lines:
+                self.stream.write("".join(json.dumps(event) + "\n" for event in self.pending))
+            else:
+                self.stream.write("".join(self.pending))
+            self.stream.flush()
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def flush_frames(self):
+        # Writes out deltas that arrived within a frame once the frame is over
+        with self.condition:
+            while True:
+                self.condition.wait_for(lambda: self.pending)
+                delay = self.last_flush + self.interval - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                else:
+                    self.flush_pending()
+
+
+class RendererLog(io.TextIOBase):
+    # Stands in for sys.stdout in JSON lines mode so prints from tools become
+    # log events instead of breaking the stream
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.renderer.emit("log", text, delta=True)
+        return len(text)
+
+
+renderer = Renderer()
 
 
 # First create an EventHandler class to define how we want to handle the events in the response stream
 class EventHandler(AssistantEventHandler):
+    def __init__(self) -> None:
+        super().__init__()
+        # The run as it stopped for tool outputs, if it did
+        self.required_action_run = None
+
     @override
     def on_text_created(self, text) -> None:
-        print(f"\nAssistant > ", end="", flush=True)
+        renderer.emit("message.created", "\nAssistant > ")
 
     @override
     def on_text_delta(self, delta, snapshot):
-        print(delta.value, end="", flush=True)
+        renderer.emit("text.delta", delta.value, delta=True)
 
     def on_tool_call_created(self, tool_call):
-        print(f"\nAssistant > {tool_call.type}\n", flush=True)
         if tool_call.type == "function":
-            print(f"Building function call args for {tool_call.function.name}")
+            renderer.emit(
+                "tool_call.created",
+                f"\nAssistant > {tool_call.type}\n\nBuilding function call args for {tool_call.function.name}\n",
+                type=tool_call.type,
+                name=tool_call.function.name,
+            )
+        else:
+            renderer.emit("tool_call.created", f"\nAssistant > {tool_call.type}\n\n", type=tool_call.type)
 
     def on_tool_call_delta(self, delta, snapshot):
         if delta.type == "function":
             if DEBUG:
-                string = delta.function.arguments
-                print(string, end="", flush=True)
+                renderer.emit("function.arguments", delta.function.arguments, delta=True)
         if delta.type == "code_interpreter":
             if delta.code_interpreter.input:
-                print(delta.code_interpreter.input, end="", flush=True)
+                renderer.emit("code.delta", delta.code_interpreter.input, delta=True)
             if delta.code_interpreter.outputs:
-                print(f"\n\nOutput >", flush=True)
+                renderer.emit("code.output", "\n\nOutput >\n")
                 for output in delta.code_interpreter.outputs:
                     if output.type == "logs":
-                        print(f"\n{output.logs}", flush=True)
+                        renderer.emit("code.logs", f"\n{output.logs}\n", delta=True)
 
     def on_tool_call_done(self, tool_call) -> None:
-        # Get run and thread information
-        current_run = self.current_run
-        run_id, thread_id = current_run.id, current_run.thread_id
         if DEBUG:
-            print(f"\nrun_id: {run_id}")
-            print(f"thread_id: {thread_id}")
-            print(f"tool_call: {tool_call}")
-            print(f"run_status: {current_run.status}")
-        if current_run.status == "requires_action":
-            tool_outputs = []
-            for tool_call in current_run.required_action.submit_tool_outputs.tool_calls:
-                if tool_call.type == "function":
-                    function_name = tool_call.function.name
-                    function_to_call = available_functions[function_name]
-                    function_arguments = json.loads(tool_call.function.arguments)
-                    function_response = function_to_call(function_arguments)
-                    tool_outputs.append(
-                        {
-                            "tool_call_id": tool_call.id,
-                            "output": json.dumps(function_response),
-                        }
-                    )
-            if current_run.required_action.type == "submit_tool_outputs":
-                with client.beta.threads.runs.submit_tool_outputs_stream(
-                    thread_id=thread_id,
-                    run_id=run_id,
-                    tool_outputs=tool_outputs,
-                    event_handler=EventHandler(),
-                ) as stream:
-                    stream.until_done()
-        else:
-            pass
+            current_run = self.current_run
+            print(f"\ntool_call: {tool_call}")
+            if current_run is not None:
+                print(f"run_id: {current_run.id}")
+                print(f"thread_id: {current_run.thread_id}")
+                print(f"run_status: {current_run.status}")
+
+    @override
+    def on_event(self, event) -> None:
+        # Tool calls are run by run_until_done once the stream has ended, not
+        # here, so a batch is never run or submitted twice
+        if event.event == "thread.run.requires_action":
+            self.required_action_run = event.data
+
+
+def run_until_done(thread_id, assistant_id):
+    # Streams a run, answering each requires_action exactly once, until the
+    # run finishes. Every stream is closed before the next one is opened, so
+    # long tool chains loop here instead of nesting streams and handlers.
+    handler = EventHandler()
+    manager = client.beta.threads.runs.create_and_stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        event_handler=handler,
+    )
+    while True:
+        with manager as stream:
+            stream.until_done()
+        run = handler.required_action_run
+        if run is None or run.required_action.type != "submit_tool_outputs":
+            return handler.current_run
+        # Everything streamed so far goes out before the tools print
+        renderer.flush()
+        tool_outputs = run_tool_calls(run.required_action.submit_tool_outputs.tool_calls)
+        handler = EventHandler()
+        manager = client.beta.threads.runs.submit_tool_outputs_stream(
+            thread_id=thread_id,
+            run_id=run.id,
+            tool_outputs=tool_outputs,
+            event_handler=handler,
+        )
 
 
 # Assistants
@@ -378,42 +377,125 @@ MY_ASSISTANTS = {
 # Initialize client
 client = OpenAI()
 
-assistant = client.beta.assistants.create(
-    instructions=MY_ASSISTANTS["planner"]["system_prompt"],
-    tools=tools,
-    model="gpt-4-turbo-preview",
-)
-
-thread = client.beta.threads.create()
-
-# Loop on user input
-iteration = 0
-while True:
-    # Formatting reasons
-    if DEBUG:
-        print(
-            "Debug mode is currently on. To turn it off, toggle the DEBUG boolean at the top of assistant.py"
-        )
-    x = input("\nUser > " if iteration == 0 else "\n\nUser > ")
+# Assistant and thread IDs are kept between launches so an unchanged
+# assistant is reused instead of created again on every start
+STATE_FILE = os.environ.get("ASSISTANT_STATE_FILE", os.path.join(CACHE_DIR, "assistant_state.json"))
+MODEL = "gpt-4-turbo-preview"
 
-    # Allow user to exit
-    if x.lower() == "exit":
-        break
 
-    # Create a message
-    message = client.beta.threads.messages.create(
-        thread.id,
-        role="user",
-        content=x,
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_state(state):
+    replace_file(STATE_FILE, json.dumps(state, indent=2))
+
+
+def assistant_config_hash(instructions, tools, model):
+    config = json.dumps({"instructions": instructions, "tools": tools, "model": model}, sort_keys=True)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
+def get_assistant(state, name, model):
+    # Reuses the saved assistant, updates it in place if its prompt, tools or
+    # model changed, and only creates one when there is none to update
+    instructions = MY_ASSISTANTS[name]["system_prompt"]
+    config_hash = assistant_config_hash(instructions, tools, model)
+    saved = state.setdefault("assistants", {}).get(name)
+    if saved and saved["config_hash"] == config_hash:
+        try:
+            # A cheap check that it was not deleted on the server since
+            return client.beta.assistants.retrieve(saved["id"]).id
+        except NotFoundError:
+            saved = None
+    assistant_id = None
+    if saved:
+        try:
+            assistant_id = client.beta.assistants.update(
+                saved["id"], instructions=instructions, tools=tools, model=model
+            ).id
+        except NotFoundError:
+            # Deleted on the server since it was saved
+            pass
+    if assistant_id is None:
+        assistant_id = client.beta.assistants.create(
+            name=name, instructions=instructions, tools=tools, model=model
+        ).id
+    state["assistants"][name] = {"id": assistant_id, "config_hash": config_hash}
+    save_state(state)
+    return assistant_id
+
+
+def get_thread(state, name, resume):
+    threads = state.setdefault("threads", {})
+    if resume and name in threads:
+        try:
+            return client.beta.threads.retrieve(threads[name]).id
+        except NotFoundError:
+            print("The previous thread no longer exists, starting a new one")
+    elif resume:
+        print("There is no previous thread to resume, starting a new one")
+    threads[name] = client.beta.threads.create().id
+    save_state(state)
+    return threads[name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat with an assistant that builds and deploys projects.")
+    parser.add_argument("--resume", action="store_true", help="Continue the previous thread instead of a new one")
+    parser.add_argument("--assistant", choices=list(MY_ASSISTANTS), default="planner")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument(
+        "--output",
+        choices=["auto", "text", "json"],
+        default="auto",
+        help="How to show replies. auto writes text to a terminal and JSON lines anywhere else.",
     )
+    args = parser.parse_args()
+    if args.output != "auto":
+        renderer.json_lines = args.output == "json"
+    if renderer.json_lines:
+        sys.stdout = RendererLog(renderer)
+
+    state = load_state()
+    assistant_id = get_assistant(state, args.assistant, args.model)
+    thread_id = get_thread(state, args.assistant, args.resume)
+
+    # Loop on user input
+    iteration = 0
+    while True:
+        # Formatting reasons
+        if DEBUG:
+            print(
+                "Debug mode is currently on. To turn it off, toggle the DEBUG boolean at the top of assistant.py"
+            )
+        if renderer.json_lines:
+            x = input()
+        else:
+            x = input("\nUser > " if iteration == 0 else "\n\nUser > ")
+
+        # Allow user to exit
+        if x.lower() == "exit":
+            break
+
+        # Create a message
+        message = client.beta.threads.messages.create(
+            thread_id,
+            role="user",
+            content=x,
+        )
+
+        # Run assistant
+        run = run_until_done(thread_id, assistant_id)
+        renderer.emit("run.done", "", status=run.status if run is not None else None)
+
+        # Increase counter
+        iteration += 1
 
-    # Run assistant
-    with client.beta.threads.runs.create_and_stream(
-        thread_id=thread.id,
-        assistant_id=assistant.id,
-        event_handler=EventHandler(),
-    ) as stream:
-        stream.until_done()
 
-    # Increase counter
-    iteration += 1
+if __name__ == "__main__":
+    main()
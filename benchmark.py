@@ -0,0 +1,346 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import itertools
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import functions
+
+
+def time_call(function, repeat):
+    # Best of several runs, in milliseconds
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+################### HTML EXTRACTION ###################
+def synthetic_page(paragraphs=5000):
+    # A large documentation-style page with the usual site chrome around it
+    navigation = "".join(f'<li><a href="/docs/page-{i}">Page {i}</a></li>' for i in range(300))
+    body = "".join(
+        f"<h2>Section {i}</h2><p>Paragraph {i} explains how the <code>widget</code> API behaves "
+        f"when it is called with <a href='#arg-{i}'>argument {i}</a> and what it returns.</p>"
+        for i in range(paragraphs)
+    )
+    return (
+        "<html><head><style>body { margin: 0 }</style><script>window.analytics = {};</script></head>"
+        f"<body><header>Site header</header><nav><ul>{navigation}</ul></nav>"
+        f"<main><article>{body}</article></main><aside>Related links</aside><footer>Footer</footer></body></html>"
+    )
+
+
+def bench_extract(args):
+    fixtures = [(path, open(path, encoding="utf-8", errors="replace").read()) for path in args.fixtures]
+    if not fixtures:
+        fixtures = [("synthetic", synthetic_page())]
+    backends = ["soup", "stream"] + (["lxml"] if functions.lxml_html is not None else [])
+    print(f"{'fixture':<30} {'backend':<8} {'html KB':>8} {'ms':>9} {'speedup':>8} {'chars':>9}")
+    for name, html in fixtures:
+        baseline = None
+        for backend in backends:
+            elapsed, (text, _) = time_call(
+                lambda: functions.extract_page(html, max_chars=args.max_chars, backend=backend), args.repeat
+            )
+            baseline = baseline or elapsed
+            print(
+                f"{name[-30:]:<30} {backend:<8} {len(html) // 1024:>8} {elapsed:>9.1f} "
+                f"{baseline / elapsed:>7.1f}x {len(text):>9}"
+            )
+
+
+################### FORK SERVER ###################
+def bench_forkserver(args):
+    functions.ECHO_OUTPUT = False
+    python = f"{args.directory}/venv/bin/python"
+    command = [args.script] + args.arguments
+    spawn = []
+    for _ in range(args.repeat):
+        spawn.append(functions.run_captured([python] + command)["elapsed_seconds"])
+    # The first request only starts the server; wait for it to come up
+    deadline = time.monotonic() + 120
+    while functions.fork_servers.run(python, command) is None:
+        if time.monotonic() > deadline:
+            print("The fork server did not start, see its log in the temp directory")
+            return 1
+        time.sleep(0.2)
+    forked = []
+    for _ in range(args.repeat):
+        result = functions.fork_servers.run(python, command)
+        forked.append(result["elapsed_seconds"])
+    functions.fork_servers.stop_all()
+    print(f"preloaded: {', '.join(result['startup']['preloaded']) or 'nothing'}")
+    print(f"{'mode':<12} {'mean s':>8} {'best s':>8}")
+    for mode, times in (("spawn", spawn), ("forkserver", forked)):
+        print(f"{mode:<12} {sum(times) / len(times):>8.3f} {min(times):>8.3f}")
+    print(f"saved per run: {sum(spawn) / len(spawn) - sum(forked) / len(forked):.3f} s")
+
+
+################### STARTUP IMPORTS ###################
+# Dependencies functions.py only imports when a tool first needs them
+DEFERRED_MODULES = ["bs4", "requests", "selenium.webdriver", "lxml.html", "tiktoken"]
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_times(statement):
+    # Runs statement in a fresh interpreter and returns -X importtime's
+    # report as (module, self us, cumulative us, depth) in import order
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    times = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            times.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return times
+
+
+def import_cost(times, startup):
+    # Milliseconds spent on top level imports beyond interpreter startup
+    return sum(cumulative for module, _, cumulative, depth in times if depth == 0 and module not in startup) / 1000
+
+
+def bench_imports(args):
+    startup = {module for module, _, _, _ in import_times("pass")}
+    times = [row for row in import_times(f"import {args.module}") if row[0] not in startup]
+    loaded = {module for module, _, _, _ in times}
+    total = import_cost(times, startup) * 1000
+    print(f"import {args.module}: {total / 1000:.1f} ms, {len(times)} modules")
+    print(f"{'module':<40} {'self ms':>8} {'cumulative ms':>14}")
+    for module, self_us, cumulative_us, depth in sorted(times, key=lambda row: -row[2])[: args.top]:
+        print(f"{'  ' * depth + module:<40} {self_us / 1000:>8.1f} {cumulative_us / 1000:>14.1f}")
+    print()
+    print(f"{'deferred module':<40} {'at startup':>10} {'first use ms':>13}")
+    for module in DEFERRED_MODULES:
+        try:
+            cost = f"{import_cost(import_times(f'import {module}'), startup):.1f}"
+        except RuntimeError:
+            cost = "missing"
+        print(f"{module:<40} {'yes' if module in loaded else 'no':>10} {cost:>13}")
+
+
+################### SERVER MODE ###################
+class MockAssistantsApi(BaseHTTPRequestHandler):
+    # Just enough of the Assistants API for server.py. Every run asks for
+    # tool_rounds batches of calls_per_round tool calls, then streams a short
+    # reply. latency stands in for the time the model takes per stream.
+    protocol_version = "HTTP/1.1"
+    tool_rounds = 2
+    calls_per_round = 2
+    latency = 0.05
+    ids = itertools.count(1)
+    runs = {}
+
+    def log_message(self, *args):
+        pass
+
+    def new_id(self, prefix):
+        return f"{prefix}_{next(self.ids)}"
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event(self, event, data):
+        data = data if isinstance(data, str) else json.dumps(data)
+        chunk = f"event: {event}\ndata: {data}\n\n".encode()
+        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+
+    def run_object(self, run, status, required_action=None):
+        return {
+            "id": run["id"],
+            "object": "thread.run",
+            "thread_id": run["thread_id"],
+            "assistant_id": "asst_mock",
+            "status": status,
+            "required_action": required_action,
+            "created_at": 0,
+            "instructions": "",
+            "model": "mock",
+            "tools": [],
+            "file_ids": [],
+            "metadata": {},
+        }
+
+    def do_GET(self):
+        self.send_json({"id": self.path.split("/")[-1], "object": "thread", "created_at": 0, "metadata": {}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0].split("/")[2:]
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if path[0] == "assistants":
+            return self.send_json({"id": "asst_mock", "object": "assistant"})
+        if path == ["threads"]:
+            return self.send_json({"id": self.new_id("thread"), "object": "thread", "created_at": 0, "metadata": {}})
+        if path[-1] == "messages":
+            return self.send_json({"id": self.new_id("msg"), "object": "thread.message", "thread_id": path[1]})
+        if path[-1] == "runs":
+            run = {"id": self.new_id("run"), "thread_id": path[1], "round": 0}
+            self.runs[run["id"]] = run
+        else:
+            run = self.runs[path[3]]
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if run["round"] < self.tool_rounds:
+            run["round"] += 1
+            tool_calls = [
+                {
+                    "id": self.new_id("call"),
+                    "type": "function",
+                    "function": {"name": "expand_output", "arguments": json.dumps({"handle": "0" * 12})},
+                }
+                for _ in range(self.calls_per_round)
+            ]
+            required_action = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": tool_calls}}
+            self.send_event("thread.run.requires_action", self.run_object(run, "requires_action", required_action))
+        else:
+            message = {"id": self.new_id("msg"), "object": "thread.message", "content": [], "role": "assistant"}
+            self.send_event("thread.message.created", message)
+            for word in ("Done ", "with ", "the ", "run."):
+                text = {"index": 0, "type": "text", "text": {"value": word, "annotations": []}}
+                delta = {"id": message["id"], "object": "thread.message.delta", "delta": {"content": [text]}}
+                self.send_event("thread.message.delta", delta)
+            self.send_event("thread.run.completed", self.run_object(run, "completed"))
+        self.send_event("done", "[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def client_session(port, messages):
+    # Returns (seconds to the first event, seconds per run) for one session
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    first_event, run_times = None, []
+    for _ in range(messages):
+        start = time.perf_counter()
+        writer.write(json.dumps({"message": "Build it"}).encode() + b"\n")
+        await writer.drain()
+        while True:
+            event = json.loads(await reader.readline())
+            if first_event is None:
+                first_event = time.perf_counter() - start
+            if event["event"] == "error":
+                raise RuntimeError(event["message"])
+            if event["event"] == "run.done":
+                break
+        run_times.append(time.perf_counter() - start)
+    writer.close()
+    return first_event, run_times
+
+
+async def load_server(port, sessions, messages):
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client_session(port, messages) for _ in range(sessions)))
+    return time.perf_counter() - start, results
+
+
+def bench_server(args):
+    MockAssistantsApi.tool_rounds = args.tool_rounds
+    MockAssistantsApi.calls_per_round = args.calls_per_round
+    MockAssistantsApi.latency = args.latency
+    api = ThreadingHTTPServer(("127.0.0.1", 0), MockAssistantsApi)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    port = free_port()
+    state = tempfile.mkdtemp(prefix="devin-benchmark-")
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{api.server_address[1]}/v1",
+        OPENAI_API_KEY="mock",
+        ASSISTANT_STATE_FILE=os.path.join(state, "assistant_state.json"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "server.py", "--port", str(port), "--workers", str(args.workers)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.PIPE,
+    )
+    try:
+        # Wait for "Serving on ..."
+        server.stdout.readline()
+        print(
+            f"{args.tool_rounds} tool rounds of {args.calls_per_round} calls per run, "
+            f"{args.latency * 1000:.0f} ms model latency, {args.workers} tool workers"
+        )
+        print(f"{'sessions':>8} {'runs/s':>8} {'first event ms':>15} {'run p50 ms':>11} {'run p95 ms':>11}")
+        for sessions in args.sessions:
+            elapsed, results = asyncio.run(load_server(port, sessions, args.messages))
+            first_events = sorted(first for first, _ in results)
+            run_times = sorted(itertools.chain.from_iterable(times for _, times in results))
+            print(
+                f"{sessions:>8} {len(run_times) / elapsed:>8.1f} {first_events[len(first_events) // 2] * 1000:>15.1f} "
+                f"{run_times[len(run_times) // 2] * 1000:>11.1f} {run_times[int(len(run_times) * 0.95)] * 1000:>11.1f}"
+            )
+    finally:
+        server.terminate()
+        server.wait()
+        api.shutdown()
+        shutil.rmtree(state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the assistant's tools.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    extract = subparsers.add_parser("extract", help="HTML to text extraction backends")
+    extract.add_argument("fixtures", nargs="*", help="Saved HTML pages. A synthetic page is used if none are given.")
+    extract.add_argument("--repeat", type=int, default=5)
+    extract.add_argument("--max-chars", type=int, default=functions.EXTRACT_MAX_CHARS)
+    extract.set_defaults(run=bench_extract)
+
+    forkserver = subparsers.add_parser("forkserver", help="run_python_script with and without the fork server")
+    forkserver.add_argument("directory", help="Project directory containing the venv")
+    forkserver.add_argument("script", help="Python script to run")
+    forkserver.add_argument("arguments", nargs="*")
+    forkserver.add_argument("--repeat", type=int, default=10)
+    forkserver.set_defaults(run=bench_forkserver)
+
+    imports = subparsers.add_parser("imports", help="Startup import time, like python -X importtime")
+    imports.add_argument("--module", default="functions", help="Module to import")
+    imports.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    imports.set_defaults(run=bench_imports)
+
+    server = subparsers.add_parser("server", help="server.py throughput against a local mock Assistants API")
+    server.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16, 64], help="Concurrent sessions to try")
+    server.add_argument("--messages", type=int, default=3, help="Messages each session sends")
+    server.add_argument("--tool-rounds", type=int, default=2)
+    server.add_argument("--calls-per-round", type=int, default=2)
+    server.add_argument("--latency", type=float, default=0.05, help="Mock model seconds per stream")
+    server.add_argument("--workers", type=int, default=4)
+    server.set_defaults(run=bench_server)
+
+    args = parser.parse_args()
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Fork server for run_python_script.
+
+Started by functions.py with a project's own venv/bin/python as
+
+    python forkserver.py SOCKET_PATH [MODULE ...]
+
+It imports the given modules once, then forks a child for every script it is
+asked to run, so repeated runs skip interpreter startup and heavy imports.
+Only the standard library may be used here since it runs inside the venv.
+"""
+import io
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import atexit
+import runpy
+import resource
+import selectors
+import importlib
+import threading
+
+# The server exits after this long without any requests or running children
+IDLE_TIMEOUT = float(os.environ.get("FORKSERVER_IDLE_TIMEOUT", "1800"))
+
+
+def preload(modules):
+    start = time.perf_counter()
+    loaded = []
+    for module in modules:
+        try:
+            importlib.import_module(module)
+            loaded.append(module)
+        except Exception:
+            # Modules the venv does not have are simply not preloaded
+            pass
+    return loaded, time.perf_counter() - start
+
+
+def reopen_stdio():
+    # Fresh stdio objects so buffering follows the new file descriptors the
+    # way it would for an interpreter started on them
+    sys.stdin = sys.__stdin__ = io.TextIOWrapper(io.BufferedReader(io.FileIO(0, "r", closefd=False)))
+    sys.stdout = sys.__stdout__ = io.TextIOWrapper(
+        io.BufferedWriter(io.FileIO(1, "w", closefd=False)), line_buffering=os.isatty(1)
+    )
+    sys.stderr = sys.__stderr__ = io.TextIOWrapper(
+        io.BufferedWriter(io.FileIO(2, "w", closefd=False)), errors="backslashreplace", line_buffering=True
+    )
+
+
+def reseed_random_state():
+    # Preloaded modules seeded their random state once, in the server, and
+    # every child would otherwise draw the same numbers. The random module
+    # reseeds itself after a fork; numpy's global RandomState does not.
+    numpy = sys.modules.get("numpy")
+    if numpy is not None:
+        try:
+            numpy.random.seed()
+        except Exception:
+            pass
+
+
+def run_child(request, stdout, stderr):
+    # Runs in the forked child and never returns
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(stdout, 1)
+    os.dup2(stderr, 2)
+    for fd in (devnull, stdout, stderr):
+        os.close(fd)
+    reopen_stdio()
+    # The sandbox the caller asked for
+    if request.get("cgroup"):
+        with open(os.path.join(request["cgroup"], "cgroup.procs"), "w") as f:
+            f.write("0")
+    for name, limits in request.get("limits", []):
+        try:
+            resource.setrlimit(getattr(resource, name), tuple(limits))
+        except (ValueError, OSError):
+            pass
+    reseed_random_state()
+    os.chdir(request["cwd"])
+    # Tracebacks show the absolute path, as they do for `python script.py`
+    script = os.path.abspath(request["argv"][0])
+    sys.argv = list(request["argv"])
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    exit_code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # Hide the runpy frames so the traceback reads like a normal run
+        traceback = e.__traceback__
+        while traceback is not None and traceback.tb_frame.f_code.co_filename != script:
+            traceback = traceback.tb_next
+        if traceback is not None:
+            e.__traceback__ = traceback
+        sys.excepthook(type(e), e, e.__traceback__)
+        exit_code = 1
+    # What the interpreter does on the way out
+    shutdown = getattr(threading, "_shutdown", None)
+    if shutdown is not None:
+        shutdown()
+    atexit._run_exitfuncs()
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    os._exit(exit_code & 0xFF)
+
+
+def serve(socket_path, modules):
+    loaded, preload_seconds = preload(modules)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only this user may connect, whatever directory the socket is in
+    umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen()
+    # Children are reaped from the main loop, woken through this pipe
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    # Leave through the finally below so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    selector.register(wakeup_read, selectors.EVENT_READ)
+    children = {}
+    last_active = time.monotonic()
+    try:
+        while True:
+            events = selector.select(timeout=60)
+            if not events and not children and time.monotonic() - last_active > IDLE_TIMEOUT:
+                break
+            for key, _ in events:
+                if key.fileobj is server:
+                    connection, _ = server.accept()
+                    last_active = time.monotonic()
+                    try:
+                        message, fds, _, _ = socket.recv_fds(connection, 65536, 2)
+                        request = json.loads(message)
+                    except (OSError, ValueError):
+                        connection.close()
+                        continue
+                    if len(fds) != 2:
+                        for fd in fds:
+                            os.close(fd)
+                        connection.close()
+                        continue
+                    pid = os.fork()
+                    if pid == 0:
+                        signal.set_wakeup_fd(-1)
+                        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                        selector.close()
+                        server.close()
+                        connection.close()
+                        os.close(wakeup_read)
+                        os.close(wakeup_write)
+                        run_child(request, *fds)
+                    for fd in fds:
+                        os.close(fd)
+                    children[pid] = connection
+                    reply = {"pid": pid, "preloaded": loaded, "preload_seconds": round(preload_seconds, 3)}
+                    try:
+                        connection.sendall(json.dumps(reply).encode() + b"\n")
+                    except OSError:
+                        pass
+                else:
+                    try:
+                        os.read(wakeup_read, 4096)
+                    except BlockingIOError:
+                        pass
+            # Reap every child that has finished and report its exit code
+            while children:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                connection = children.pop(pid, None)
+                if connection is not None:
+                    exit_code = os.waitstatus_to_exitcode(status)
+                    try:
+                        connection.sendall(json.dumps({"exit_code": exit_code}).encode() + b"\n")
+                    except OSError:
+                        pass
+                    connection.close()
+                last_active = time.monotonic()
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2:])
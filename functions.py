@@ -1,26 +1,163 @@
 import os
 import time
 import venv
+import re
+import errno
+import shlex
+import sys
 import json
+import math
+import pty
+import fcntl
+import shutil
+import select
+import socket
+import resource
+import codecs
+import signal
+import struct
+import termios
+import tempfile
+import itertools
+import selectors
+import atexit
+import sqlite3
+import hashlib
+import importlib
+import importlib.util
+import fnmatch
+import difflib
+import threading
 import subprocess
-from bs4 import BeautifulSoup
-from requests import get
-from selenium import webdriver
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qs, parse_qsl, urlencode, quote_plus
 
+# The regex parser, for the literals a pattern needs
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
 
+
+
+class LazyModule:
+    # Stands in for a module and imports it the first time one of its
+    # attributes is used, so sessions that never browse skip the cost
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+bs4 = LazyModule("bs4")
+requests = LazyModule("requests")
+webdriver = LazyModule("selenium.webdriver")
+selenium_exceptions = LazyModule("selenium.common.exceptions")
+
+# Optional: lxml makes HTML extraction several times faster
+if importlib.util.find_spec("lxml") is not None:
+    lxml_html = LazyModule("lxml.html")
+    etree = LazyModule("lxml.etree")
+else:
+    lxml_html = etree = None
+
+# Optional: tiktoken gives exact token counts for output budgets
+tiktoken = LazyModule("tiktoken") if importlib.util.find_spec("tiktoken") is not None else None
+
+# Caches that should survive between sessions live here
+CACHE_DIR = os.environ.get("DEVIN_CACHE_DIR", os.path.expanduser("~/.cache/devin_ai"))
+
+
+################### TOOL REGISTRY ###################
+# Each tool registers the schema the model sees right above its
+# implementation. Schemas are kept in definition order.
+tool_schemas = {}
+available_functions = {}
+
+
+def tool(description, parameters):
+    def register(function):
+        name = function.__name__
+        tool_schemas[name] = {
+            "type": "function",
+            "function": {"name": name, "description": description, "parameters": parameters},
+        }
+        available_functions[name] = function
+        return function
+
+    return register
+
+
+@tool(
+    description="""Copy a file or a whole directory tree from any location into another directory.
+    Symlinks are kept as symlinks. Returns the number of files and bytes copied, how they were copied,
+    and any files that could not be copied. A directory cannot be copied into itself.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "file_name": {
+                "type": "string",
+                "description": """The full path of the file or directory to copy.""",
+            },
+            "directory": {
+                "type": "string",
+                "description": "The directory to copy the file or directory into.",
+            },
+        },
+        "required": ["file_name", "directory"],
+    },
+)
 def copy_file(args):
     # Decode arguments
     file_name = args.get("file_name")
     directory = args.get("directory")
-    if not os.path.isdir(directory):
-        subprocess.run(["mkdir", directory])
-    subprocess.run(["cp", file_name, directory])
-    status_message = f"Successfully copied {file_name} to {directory}"
+    # Copy the file, or the whole tree if it is a directory, into directory
+    target = os.path.join(directory, os.path.basename(os.path.normpath(file_name)))
+    try:
+        report = copy_tree(file_name, target)
+    except (OSError, ValueError) as e:
+        return json.dumps({"error": str(e)})
+    project_indexes.notify(target)
+    status_message = f"Copied {file_name} to {directory}: {report['files']} files, {report['bytes_copied']} bytes"
+    if report["errors"]:
+        status_message += f", {len(report['errors'])} errors"
     print(status_message)
-    return json.dumps({"status": status_message})
-    return write_file(file_name, file_contents)
+    return json.dumps({"status": status_message, **report})
 
 
+@tool(
+    description="""Create and write a file for the user in the language specified as an argument.
+    The extension of the file name must match the language that you are writing in.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "language": {
+                "type": "string",
+                "description": """The language of the file. This could be any one of, but not limited to,
+                Python, CSS, Javascript, C++, or text.""",
+            },
+            "file_name": {
+                "type": "string",
+                "description": """The file name. This should be prefaced by the same directory
+                that the rest of the project is being built in. If there is no current project
+                being worked on, then default to beginning the file name with 'auto/'.""",
+            },
+            "file_contents": {
+                "type": "string",
+                "description": "The contents of the Python file.",
+            },
+        },
+        "required": ["language", "file_name", "file_contents"],
+    },
+)
 def write_file(args):
     # Decode arguments
     file_name = args.get("file_name")
@@ -30,193 +167,3034 @@ def write_file(args):
     f = open(file_name, "w")
     f.write(file_contents)
     f.close()
+    project_indexes.notify(file_name)
     status_message = f"Wrote contents to {file_name} successfully!"
     print(status_message)
     return json.dumps({"status": status_message})
 
 
+@tool(
+    description="""Change part of an existing file without rewriting all of it. Prefer this over
+    write_file for small fixes. Give either a unified diff or a list of search/replace edits. Either
+    every hunk is applied or, if any of them does not match the file, none are and the conflicts
+    are reported.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "file_name": {
+                "type": "string",
+                "description": """The file to edit.""",
+            },
+            "diff": {
+                "type": "string",
+                "description": """A unified diff against the file, with @@ hunk headers and a few lines
+                of context around each change.""",
+            },
+            "edits": {
+                "type": "array",
+                "description": """Search/replace edits, used when no diff is given. The search text must
+                match exactly one place in the file; include enough surrounding lines to make it unique.""",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "search": {
+                            "type": "string",
+                            "description": "The lines to replace, copied from the file.",
+                        },
+                        "replace": {
+                            "type": "string",
+                            "description": "The new lines.",
+                        },
+                    },
+                    "required": ["search", "replace"],
+                },
+            },
+        },
+        "required": ["file_name"],
+    },
+)
+def edit_file(args):
+    # Decode arguments
+    file_name = args.get("file_name")
+    diff = args.get("diff")
+    edits = args.get("edits")
+    if not diff and not edits:
+        return json.dumps({"error": "Give either a diff or a list of edits"})
+    try:
+        # newline="" keeps CRLF line endings as they are
+        with open(file_name, newline="") as f:
+            text = f.read()
+    except OSError as e:
+        return json.dumps({"error": str(e)})
+    # Apply every hunk or none of them
+    try:
+        hunks = parse_unified_diff(diff) if diff else search_replace_hunks(edits or [])
+    except ValueError as e:
+        return json.dumps({"error": str(e)})
+    new_text, applied, conflicts = apply_hunks(text, hunks)
+    if conflicts:
+        status_message = f"Did not edit {file_name}: {len(conflicts)} of {len(hunks)} hunks did not apply"
+        print(status_message)
+        return json.dumps({"status": status_message, "conflicts": conflicts})
+    replace_file(file_name, new_text)
+    project_indexes.notify(file_name)
+    status_message = f"Applied {len(hunks)} hunks to {file_name}"
+    print(status_message)
+    return json.dumps({"status": status_message, "hunks": applied})
+
+
+# mkstemp creates files as 0600; new files get the mode open() would give
+# them. Read once here since os.umask can only be read by changing it.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+@tool(
+    description="""Create or overwrite several files in one call. Prefer this over calling write_file
+    once per file, for example when setting up the components of a React app. Files that already
+    have the given contents are left untouched.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "files": {
+                "type": "array",
+                "description": """The files to write.""",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "file_name": {
+                            "type": "string",
+                            "description": """The file name. This should be prefaced by the same directory
+                            that the rest of the project is being built in. If there is no current project
+                            being worked on, then default to beginning the file name with 'auto/'.""",
+                        },
+                        "file_contents": {
+                            "type": "string",
+                            "description": "The contents of the file.",
+                        },
+                    },
+                    "required": ["file_name", "file_contents"],
+                },
+            },
+        },
+        "required": ["files"],
+    },
+)
+def write_files(args):
+    # Decode arguments
+    files = args.get("files", [])
+    # Write every file, skipping the ones that already have these contents
+    written, unchanged, failed = [], [], {}
+    for index, file in enumerate(files):
+        file_name = file.get("file_name") if isinstance(file, dict) else None
+        if not isinstance(file_name, str) or not file_name:
+            failed[f"files[{index}]"] = "file_name must be a non-empty string"
+            continue
+        file_contents = file.get("file_contents", "")
+        if not isinstance(file_contents, str):
+            failed[file_name] = f"file_contents must be a string, not {type(file_contents).__name__}"
+            continue
+        try:
+            if replace_file(file_name, file_contents):
+                written.append(file_name)
+                project_indexes.notify(file_name)
+            else:
+                unchanged.append(file_name)
+        except (OSError, TypeError) as e:
+            failed[file_name] = str(e)
+    status_message = f"Wrote {len(written)} files, {len(unchanged)} unchanged, {len(failed)} failed"
+    print(status_message)
+    return json.dumps({"status": status_message, "written": written, "unchanged": unchanged, "failed": failed})
+
+
+def replace_file(file_name, file_contents):
+    # Writes through a temp file and a rename so readers like a watch build
+    # never see a half written file. Returns False if nothing changed.
+    data = file_contents.encode()
+    try:
+        with open(file_name, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    directory = os.path.dirname(file_name) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_name)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if os.path.exists(file_name):
+            shutil.copymode(file_name, temp_name)
+        else:
+            os.chmod(temp_name, 0o666 & ~UMASK)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    return True
+
+
+@tool(
+    description="""Runs a Python script using the virtual environment directory supplied.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "file_name": {
+                "type": "string",
+                "description": """The full path of the Python file to be run.""",
+            },
+            "directory": {
+                "type": "string",
+                "description": """The directory that you can find the virtual environment in.""",
+            },
+            "arguments": {
+                "type": "array",
+                "description": """A list of arguments to pass into the Python script.""",
+                "items": {
+                    "type": "string",
+                },
+            },
+            "timeout": {
+                "type": "number",
+                "description": """Seconds the script may run before it is stopped. Defaults to 300.""",
+            },
+        },
+        "required": ["file_name", "directory"],
+    },
+)
 def run_python_script(args):
     # Decode arguments
     file_name = args.get("file_name")
     directory = args.get("directory")
     arguments = args.get("arguments", [])
-    # Run the python script
-    p = subprocess.Popen(
-        [f"{directory}/venv/bin/python", file_name] + arguments,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    output, error = p.communicate()
-    return json.dumps({"output": str(output), "error": str(error)})
+    timeout = float(args.get("timeout", SCRIPT_TIMEOUT))
+    # Run the python script, through the venv's fork server when it is up
+    python = f"{directory}/venv/bin/python"
+    result = fork_servers.run(python, [file_name] + arguments, timeout) if FORKSERVER_ENABLED else None
+    if result is None:
+        result = run_captured([python, file_name] + arguments, timeout)
+        result["startup"] = {"mode": "spawn"}
+    return json.dumps(result)
 
 
+@tool(
+    description="""Opens a png file.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "file_name": {
+                "type": "string",
+                "description": """The full path of the png file to be opened.""",
+            },
+        },
+        "required": ["file_name"],
+    },
+)
 def open_png_file(args):
     # Decode arguments
     file_name = args.get("file_name")
-    # Run the python script
-    p = subprocess.Popen(
-        ["open", file_name],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    output, error = p.communicate()
-    return json.dumps({"output": str(output), "error": str(error)})
+    # Open it with the system viewer
+    result = run_captured(["open", file_name], profile="command", echo=False)
+    return json.dumps(result)
 
 
+@tool(
+    description="""Create a project directory for a web application. The directory should always start with
+    'auto/' and end with a suffix that briefly describes the coding project in CamelCase.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "directory": {
+                "type": "string",
+                "description": """The directory in which the code development will take place. Please preface
+                this directory with 'auto/' and end with a suffix that briefly describes the coding project in
+                CamelCase.""",
+            },
+        },
+        "required": ["directory"],
+    },
+)
 def create_project_directory(args):
     # Creates a project directory
     directory = args.get("directory")
-    if not os.path.isdir(directory):
-        subprocess.run(["mkdir", directory])
+    os.makedirs(directory, exist_ok=True)
     status_message = f"Successfully created {directory}"
     print(status_message)
     return json.dumps({"status": status_message})
 
 
+@tool(
+    description="""Initializes a vanilla React app with Chakra UI for frontend components in the project
+    directory specified.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "directory": {
+                "type": "string",
+                "description": """The directory in which the code development will take place.""",
+            },
+        },
+        "required": ["directory"],
+    },
+)
 def initialize_react_app(args):
     # Creates a project directory
     directory = args.get("directory")
-    if not os.path.isdir(directory):
-        subprocess.run(["mkdir", directory])
-    # Initialize React app with Chakra UI and netlify
-    subprocess.run(["npx", "create-react-app", "my-app"], cwd=directory)
-    subprocess.run(["npm", "install", "@chakra-ui/react"], cwd=f"{directory}/my-app")
-    subprocess.run(["npm", "install", "netlify-cli"], cwd=f"{directory}/my-app")
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    app_directory = os.path.join(directory, "my-app")
+    try:
+        skeleton = None if os.path.exists(app_directory) else get_react_skeleton()
+        if skeleton is not None:
+            clone_react_skeleton(skeleton, app_directory)
+            method = "skeleton"
+        else:
+            # Initialize React app with Chakra UI and netlify
+            error = create_react_app(directory)
+            if error:
+                raise RuntimeError(error)
+            method = "npm"
+    except (OSError, RuntimeError) as e:
+        # A skeleton that failed to build is not retried with the same
+        # commands here
+        status_message = f"Could not initialize a React app in {directory}"
+        print(status_message)
+        return json.dumps({"status": status_message, "error": str(e)})
     status_message = f"Successfully initialized React app in {directory}"
     print(status_message)
-    return json.dumps({"status": status_message})
+    return json.dumps(
+        {
+            "status": status_message,
+            "method": method,
+            "elapsed_seconds": round(time.perf_counter() - start, 3),
+        }
+    )
+
+
+################### FILE COPIES ###################
+# ioctl that makes the target share the source's extents (btrfs, XFS, ...)
+FICLONE = 0x40049409
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def copy_file_data(source, target):
+    # Copies contents and metadata without the data passing through Python.
+    # Returns (bytes copied, method used).
+    if os.path.exists(target) and os.path.samefile(source, target):
+        raise shutil.SameFileError(f"{source} and {target} are the same file")
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        source_fd, target_fd = source_file.fileno(), target_file.fileno()
+        size = os.fstat(source_fd).st_size
+        method = None
+        try:
+            fcntl.ioctl(target_fd, FICLONE, source_fd)
+            method = "reflink"
+        except OSError:
+            pass
+        if method is None and hasattr(os, "copy_file_range"):
+            try:
+                copied = 0
+                while True:
+                    count = os.copy_file_range(source_fd, target_fd, COPY_CHUNK_BYTES)
+                    if count == 0:
+                        break
+                    copied += count
+                method = "copy_file_range"
+            except OSError:
+                # Unsupported here, for example across filesystems on older
+                # kernels; start over with plain copies
+                os.lseek(source_fd, 0, os.SEEK_SET)
+                os.ftruncate(target_fd, 0)
+                os.lseek(target_fd, 0, os.SEEK_SET)
+        if method is None:
+            shutil.copyfileobj(source_file, target_file, COPY_CHUNK_BYTES)
+            method = "read_write"
+    shutil.copystat(source, target)
+    return size, method
+
+
+def copy_tree(source, target):
+    # Copies a file or directory tree, keeping symlinks as symlinks. Errors
+    # on single files are collected instead of stopping the copy.
+    start = time.perf_counter()
+    report = {"files": 0, "bytes_copied": 0, "methods": Counter(), "errors": {}}
+
+    def copy_entry(source, target):
+        try:
+            if os.path.islink(source):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(os.readlink(source), target)
+                return
+            copied, method = copy_file_data(source, target)
+            report["files"] += 1
+            report["bytes_copied"] += copied
+            report["methods"][method] += 1
+        except OSError as e:
+            report["errors"][source] = str(e)
+
+    if os.path.isdir(source) and not os.path.islink(source):
+        # The walk would find the copy and copy it again, without end
+        real_source = os.path.realpath(source)
+        if os.path.commonpath([real_source, os.path.realpath(target)]) == real_source:
+            raise ValueError(f"Cannot copy {source} into itself")
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    if os.path.isdir(source) and not os.path.islink(source):
+        for root, dirs, files in os.walk(source):
+            target_root = os.path.normpath(os.path.join(target, os.path.relpath(root, source)))
+            os.makedirs(target_root, exist_ok=True)
+            for name in dirs:
+                if os.path.islink(os.path.join(root, name)):
+                    copy_entry(os.path.join(root, name), os.path.join(target_root, name))
+            for name in files:
+                copy_entry(os.path.join(root, name), os.path.join(target_root, name))
+        shutil.copystat(source, target)
+    elif os.path.exists(source) or os.path.islink(source):
+        copy_entry(source, target)
+    else:
+        raise FileNotFoundError(f"{source} does not exist")
+    report["methods"] = dict(report["methods"])
+    report["elapsed_seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
 
+################### REACT SKELETON ###################
+# A prepared my-app that new projects are cloned from
+REACT_SKELETON_DIR = os.path.join(CACHE_DIR, "react")
+REACT_PACKAGES = ["@chakra-ui/react", "netlify-cli"]
 
+
+def create_react_app(directory):
+    # Returns an error message, or None if every step succeeded
+    steps = [
+        (["npx", "create-react-app", "my-app"], directory),
+        (["npm", "install", REACT_PACKAGES[0]], f"{directory}/my-app"),
+        (["npm", "install", REACT_PACKAGES[1]], f"{directory}/my-app"),
+    ]
+    for command, cwd in steps:
+        result = run_captured(command, cwd=cwd, profile="node")
+        if result["exit_code"] != 0:
+            return f"{' '.join(command)} failed with exit code {result['exit_code']}:\n{result['error']}"
+    return None
+
+
+def react_skeleton_key():
+    versions = []
+    for tool in ("node", "npm"):
+        try:
+            versions.append(run_captured([tool, "--version"], profile="command", echo=False)["output"].strip())
+        except OSError:
+            return None
+    content = "\n".join(versions + REACT_PACKAGES)
+    return hashlib.sha256(content.encode()).hexdigest()[:24]
+
+
+def file_sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def react_skeleton_is_intact(skeleton_dir):
+    app_directory = os.path.join(skeleton_dir, "my-app")
+    try:
+        with open(os.path.join(skeleton_dir, "skeleton.json")) as f:
+            metadata = json.load(f)
+        lockfile_sha256 = file_sha256(os.path.join(app_directory, "package-lock.json"))
+        # npm keeps its own record of what is in node_modules
+        installed_sha256 = file_sha256(os.path.join(app_directory, "node_modules", ".package-lock.json"))
+    except (OSError, ValueError):
+        return False
+    return lockfile_sha256 == metadata["lockfile_sha256"] and installed_sha256 == metadata.get("installed_sha256")
+
+
+def get_react_skeleton():
+    # Returns the skeleton's my-app directory, or None without node and npm.
+    # Raises RuntimeError if building it failed.
+    key = react_skeleton_key()
+    if key is None:
+        return None
+    skeleton_dir = os.path.join(REACT_SKELETON_DIR, key)
+    os.makedirs(REACT_SKELETON_DIR, exist_ok=True)
+    with open(os.path.join(REACT_SKELETON_DIR, f"{key}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not react_skeleton_is_intact(skeleton_dir):
+            shutil.rmtree(skeleton_dir, ignore_errors=True)
+            os.makedirs(skeleton_dir)
+            error = create_react_app(skeleton_dir)
+            if error:
+                shutil.rmtree(skeleton_dir, ignore_errors=True)
+                raise RuntimeError(error)
+            app_directory = os.path.join(skeleton_dir, "my-app")
+            metadata = {
+                "lockfile_sha256": file_sha256(os.path.join(app_directory, "package-lock.json")),
+                "installed_sha256": file_sha256(os.path.join(app_directory, "node_modules", ".package-lock.json")),
+            }
+            with open(os.path.join(skeleton_dir, "skeleton.json"), "w") as f:
+                json.dump(metadata, f)
+    return os.path.join(skeleton_dir, "my-app")
+
+
+def is_npm_metadata(relative_path):
+    # node_modules/.package-lock.json, node_modules/.cache/... as opposed
+    # to the installed packages
+    parts = relative_path.split(os.sep)
+    return len(parts) > 1 and parts[0] == "node_modules" and parts[1].startswith(".")
+
+
+def clone_react_skeleton(skeleton, app_directory):
+    # Installed packages are shared through hardlinks. Sources, package
+    # files and the git repository are copied because the project edits
+    # them in place, and so is npm's own metadata in node_modules
+    # (.package-lock.json, .cache), which npm and the build rewrite in place.
+    for root, dirs, files in os.walk(skeleton):
+        relative = os.path.relpath(root, skeleton)
+        target_root = os.path.normpath(os.path.join(app_directory, relative))
+        os.makedirs(target_root, exist_ok=True)
+        in_node_modules = relative.split(os.sep)[0] == "node_modules"
+        for name in dirs:
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), os.path.join(target_root, name))
+        for name in files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+            elif in_node_modules and not is_npm_metadata(os.path.join(relative, name)):
+                link_or_copy(source, target)
+            else:
+                copy_file_data(source, target)
+
+
+@tool(
+    description="""Deploys the React app to netlify. On a successful function call, please display the
+    Website URL for the user to access the application online.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "directory": {
+                "type": "string",
+                "description": """The project directory. This should never have '/my-app' as a suffix.""",
+            },
+        },
+        "required": ["directory"],
+    },
+)
 def deploy_app_to_netlify(args):
     # Decode arguments
     directory = args.get("directory")
-    # Build the React app
-    p = subprocess.Popen(["npm", "run", "build"], cwd=f"{directory}/my-app")
-    p.wait()
-    # Deploy to netlify
-    p = subprocess.Popen(
-        ["netlify", "deploy", "--dir", "./build", "--prod"],
-        cwd=f"{directory}/my-app",
-        stdin=subprocess.PIPE,
+    return json.dumps(build_and_deploy(f"{directory}/my-app"))
+
+
+@tool(
+    description="""Re-deploy the React app to netlify. Only call if the web app has already been deployed
+    to netlify on a previous call. On a successful function call, please display the website URL for the user
+    to access the web app online.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "directory": {
+                "type": "string",
+                "description": """The project directory. This should never have '/my-app' as a suffix.""",
+            },
+        },
+        "required": ["directory"],
+    },
+)
+def redeploy_app_to_netlify(args):
+    # Decode arguments
+    directory = args.get("directory")
+    return json.dumps(build_and_deploy(f"{directory}/my-app"))
+
+
+################### BUILD MANIFEST ###################
+# Records what the last build was made from and what was last deployed, so
+# unchanged projects are neither rebuilt nor uploaded again
+BUILD_MANIFEST = ".build-manifest.json"
+BUILD_INPUTS = ["src", "public", "package.json", "package-lock.json"]
+
+
+def hash_tree(root, paths):
+    # Returns {relative path: sha256} for every file under the given paths
+    hashes = {}
+    for path in paths:
+        full_path = os.path.join(root, path)
+        if os.path.isfile(full_path):
+            hashes[path] = file_sha256(full_path)
+        for walk_root, dirs, files in os.walk(full_path):
+            dirs.sort()
+            for name in sorted(files):
+                file_name = os.path.join(walk_root, name)
+                hashes[os.path.relpath(file_name, root)] = file_sha256(file_name)
+    return hashes
+
+
+def source_fingerprint(app_directory):
+    content = json.dumps(hash_tree(app_directory, BUILD_INPUTS), sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def load_build_manifest(app_directory):
+    try:
+        with open(os.path.join(app_directory, BUILD_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_build_manifest(app_directory, manifest):
+    with open(os.path.join(app_directory, BUILD_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def changed_files(old_hashes, new_hashes):
+    return {
+        "added": sorted(set(new_hashes) - set(old_hashes)),
+        "modified": sorted(name for name in new_hashes if name in old_hashes and old_hashes[name] != new_hashes[name]),
+        "removed": sorted(set(old_hashes) - set(new_hashes)),
+    }
+
+
+def build_and_deploy(app_directory):
+    manifest = load_build_manifest(app_directory)
+    timings = {}
+    # Build the React app unless its sources are unchanged since the last build
+    start = time.perf_counter()
+    fingerprint = source_fingerprint(app_directory)
+    build_skipped = fingerprint == manifest.get("source") and os.path.isdir(os.path.join(app_directory, "build"))
+    if not build_skipped:
+        error = build_app(app_directory)
+        if error:
+            return {"output": "", "error": error, "build_skipped": False}
+        manifest["source"] = fingerprint
+        manifest["build"] = hash_tree(app_directory, ["build"])
+        save_build_manifest(app_directory, manifest)
+    timings["build"] = round(time.perf_counter() - start, 3)
+    # Upload only if the build differs from what was deployed last time
+    changes = changed_files(manifest.get("deployed", {}), manifest["build"])
+    if "deploy_output" in manifest and not any(changes.values()):
+        return {
+            "output": manifest["deploy_output"],
+            "error": "",
+            "status": "Nothing changed since the last deploy, the site is already up to date.",
+            "build_skipped": build_skipped,
+            "changed_files": changes,
+            "timings": timings,
+        }
+    # Deploy to netlify, answering its prompts as soon as they are shown
+    process = InteractiveProcess(["netlify", "deploy", "--dir", "./build", "--prod"], cwd=app_directory)
+    error = ""
+    try:
+        timings.update(process.interact(NETLIFY_PROMPTS))
+    except TimeoutError as e:
+        process.kill()
+        error = str(e)
+    returncode = process.wait()
+    output = process.output()
+    if process.limit_exceeded is not None:
+        error = f"netlify was stopped by the {process.limit_exceeded} limit"
+    if returncode == 0 and not error:
+        manifest["deployed"] = manifest["build"]
+        manifest["deploy_output"] = output
+        save_build_manifest(app_directory, manifest)
+    return {
+        "output": output,
+        "error": error,
+        "returncode": returncode,
+        "build_skipped": build_skipped,
+        "changed_files": changes,
+        "timings": timings,
+    }
+
+
+################### BUILD DAEMONS ###################
+# Projects whose package.json defines this script get a long-lived watch
+# build that later builds wait on instead of starting a cold `npm run build`
+BUILD_WATCH_SCRIPT = "build:watch"
+# Output of the watch build that marks a build starting, finishing or failing
+BUILD_STARTED = re.compile(r"Compiling|Rebuilding|File change detected", re.IGNORECASE)
+BUILD_SUCCEEDED = re.compile(r"Compiled successfully|Build complete|build folder is ready|webpack compiled", re.IGNORECASE)
+BUILD_FAILED = re.compile(r"Failed to compile|compiled with \d+ errors?|Build failed", re.IGNORECASE)
+# Longest a caller waits for the watch build before building cold instead
+BUILD_DAEMON_TIMEOUT = 300
+# Watch builds nobody has waited on for this long are stopped
+BUILD_DAEMON_IDLE_TIMEOUT = float(os.environ.get("BUILD_DAEMON_IDLE_TIMEOUT", "900"))
+
+
+def has_watch_script(app_directory):
+    try:
+        with open(os.path.join(app_directory, "package.json")) as f:
+            return BUILD_WATCH_SCRIPT in json.load(f).get("scripts", {})
+    except (OSError, ValueError):
+        return False
+
+
+def newest_source_mtime(app_directory):
+    newest = 0.0
+    for path in BUILD_INPUTS:
+        full_path = os.path.join(app_directory, path)
+        if os.path.isfile(full_path):
+            newest = max(newest, os.path.getmtime(full_path))
+        for root, dirs, files in os.walk(full_path):
+            for name in files:
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+    return newest
+
+
+class BuildDaemon:
+    def __init__(self, app_directory):
+        self.app_directory = app_directory
+        self.process = launch(
+            ["npm", "run", BUILD_WATCH_SCRIPT],
+            profile="node",
+            cwd=app_directory,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        )
+        self.condition = threading.Condition()
+        self.log = deque(maxlen=200)
+        # Wall clock start of the build in progress and of the last finished
+        # one. The watch build starts with a full build of its own.
+        self.current_started = time.time()
+        self.finished_started = 0.0
+        self.succeeded = None
+        self.exited = False
+        self.last_used = time.monotonic()
+        threading.Thread(target=self.read_output, name="build-daemon", daemon=True).start()
+
+    def read_output(self):
+        for line in self.process.stdout:
+            self.log.append(line.rstrip())
+            with self.condition:
+                if BUILD_STARTED.search(line) and self.current_started is None:
+                    self.current_started = time.time()
+                elif BUILD_FAILED.search(line) or BUILD_SUCCEEDED.search(line):
+                    self.finished_started = self.current_started or time.time()
+                    self.current_started = None
+                    self.succeeded = not BUILD_FAILED.search(line)
+                    self.condition.notify_all()
+        self.process.wait()
+        limit = release_sandbox(self.process.sandbox, self.process.returncode, "\n".join(self.log))
+        if limit is not None:
+            self.log.append(f"Stopped by the {limit} limit.")
+        with self.condition:
+            self.exited = True
+            self.condition.notify_all()
+
+    def wait_for_build(self, since, timeout=BUILD_DAEMON_TIMEOUT):
+        # Waits for a build that started after the sources last changed.
+        # Returns whether it succeeded, or None if no such build finished.
+        self.last_used = time.monotonic()
+        with self.condition:
+            self.condition.wait_for(lambda: self.finished_started >= since or self.exited, timeout)
+            self.last_used = time.monotonic()
+            if self.finished_started >= since:
+                return self.succeeded
+            return None
+
+    def stop(self):
+        if self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+
+
+class BuildDaemons:
+    def __init__(self, idle_timeout=BUILD_DAEMON_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.daemons = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def get(self, app_directory):
+        key = os.path.abspath(app_directory)
+        with self.lock:
+            daemon = self.daemons.get(key)
+            if daemon is None or daemon.exited:
+                daemon = self.daemons[key] = BuildDaemon(app_directory)
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap, name="build-daemon-reaper", daemon=True)
+                self.reaper.start()
+            return daemon
+
+    def discard(self, app_directory):
+        with self.lock:
+            daemon = self.daemons.pop(os.path.abspath(app_directory), None)
+        if daemon is not None:
+            daemon.stop()
+
+    def reap(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 4, 1))
+            cutoff = time.monotonic() - self.idle_timeout
+            with self.lock:
+                idle = [key for key, daemon in self.daemons.items() if daemon.last_used < cutoff or daemon.exited]
+            for key in idle:
+                self.discard(key)
+
+    def stop_all(self):
+        with self.lock:
+            daemons, self.daemons = list(self.daemons.values()), {}
+        for daemon in daemons:
+            daemon.stop()
+
+
+build_daemons = BuildDaemons()
+atexit.register(build_daemons.stop_all)
+
+
+def build_app(app_directory):
+    # Returns an error message, or None if the build succeeded
+    if has_watch_script(app_directory):
+        since = newest_source_mtime(app_directory)
+        daemon = build_daemons.get(app_directory)
+        succeeded = daemon.wait_for_build(since)
+        if succeeded:
+            return None
+        if succeeded is False:
+            return "Build failed:\n" + "\n".join(daemon.log)
+        # The watch build hung or exited, so build the usual way
+        build_daemons.discard(app_directory)
+    result = run_captured(["npm", "run", "build"], cwd=app_directory, profile="node")
+    if result["exit_code"] != 0:
+        message = f"npm run build failed with exit code {result['exit_code']}"
+        if "limit_exceeded" in result:
+            message += f" after hitting the {result['limit_exceeded']} limit"
+        return f"{message}:\n{result['error']}"
+    return None
+
+
+################### SANDBOX ###################
+# Every tool subprocess is started through launch() with the resource limits
+# of a profile. None leaves a limit unset. Override a value with an
+# environment variable such as SANDBOX_SCRIPT_ADDRESS_SPACE_BYTES. Like
+# memory, the number of processes is only limited through a cgroup:
+# RLIMIT_NPROC counts every thread the user runs, not just the command's.
+SANDBOX_ENABLED = os.environ.get("SANDBOX", "1") != "0"
+SANDBOX_PROFILES = {
+    # Scripts the model wrote, the main thing this is here to contain
+    "script": {"cpu_seconds": 600, "address_space_bytes": 8 * 1024**3, "open_files": 1024, "processes": 512},
+    "pip": {"cpu_seconds": 1800, "address_space_bytes": 8 * 1024**3, "open_files": 4096, "processes": 512},
+    # V8 reserves far more address space than it uses, so node's memory can
+    # only be limited through a cgroup
+    "node": {"cpu_seconds": None, "address_space_bytes": None, "open_files": 8192, "processes": 1024},
+    # Long-lived helpers such as the fork server
+    "service": {"cpu_seconds": None, "address_space_bytes": None, "open_files": 4096, "processes": 1024},
+    # Short utility commands
+    "command": {"cpu_seconds": 60, "address_space_bytes": 2 * 1024**3, "open_files": 256, "processes": 512},
+}
+for profile_name, profile in SANDBOX_PROFILES.items():
+    for limit_name in profile:
+        value = os.environ.get(f"SANDBOX_{profile_name}_{limit_name}".upper())
+        if value is not None:
+            profile[limit_name] = int(value) if value.lower() != "none" else None
+    # Memory for the cgroup, when one is used
+    profile.setdefault("memory_bytes", profile["address_space_bytes"] or 8 * 1024**3)
+RLIMITS = {
+    "cpu_seconds": "RLIMIT_CPU",
+    "address_space_bytes": "RLIMIT_AS",
+    "open_files": "RLIMIT_NOFILE",
+}
+# Seconds between the SIGXCPU warning and SIGKILL
+CPU_GRACE_SECONDS = 5
+# A delegated cgroup v2 directory. Each command gets a child cgroup in it
+# with memory.max and pids.max set.
+SANDBOX_CGROUP = os.environ.get("SANDBOX_CGROUP")
+cgroup_counter = itertools.count()
+# What a command prints when a limit stops it
+LIMIT_MESSAGES = {
+    "address_space_bytes": re.compile(
+        r"MemoryError|Cannot allocate memory|out of memory|std::bad_alloc|heap out of memory", re.IGNORECASE
+    ),
+    "open_files": re.compile(r"Too many open files"),
+    "processes": re.compile(
+        r"Cannot fork|fork: retry|fork failed|Resource temporarily unavailable|can't start new thread"
+        r"|spawn EAGAIN",
+        re.IGNORECASE,
+    ),
+}
+
+
+def sandbox_rlimits(profile):
+    # Returns [(resource name, (soft, hard))], never above what we have now
+    limits = []
+    for limit_name, resource_name in RLIMITS.items():
+        value = profile.get(limit_name)
+        if value is None or not hasattr(resource, resource_name):
+            continue
+        _, current_hard = resource.getrlimit(getattr(resource, resource_name))
+        hard = value + CPU_GRACE_SECONDS if limit_name == "cpu_seconds" else value
+        if current_hard != resource.RLIM_INFINITY:
+            hard = min(hard, current_hard)
+        limits.append((resource_name, (min(value, hard), hard)))
+    return limits
+
+
+def create_cgroup(profile_name, profile):
+    if not SANDBOX_CGROUP:
+        return None
+    path = os.path.join(SANDBOX_CGROUP, f"{profile_name}-{os.getpid()}-{next(cgroup_counter)}")
+    try:
+        os.mkdir(path)
+        with open(os.path.join(path, "memory.max"), "w") as f:
+            f.write(str(profile["memory_bytes"]))
+        if profile["processes"] is not None:
+            with open(os.path.join(path, "pids.max"), "w") as f:
+                f.write(str(profile["processes"]))
+    except OSError:
+        # No cgroup v2 delegation here; the rlimits still apply
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return None
+    return path
+
+
+def create_sandbox(profile_name):
+    profile = SANDBOX_PROFILES[profile_name]
+    if not SANDBOX_ENABLED:
+        return {"name": profile_name, "profile": profile, "rlimits": [], "cgroup": None}
+    return {
+        "name": profile_name,
+        "profile": profile,
+        "rlimits": sandbox_rlimits(profile),
+        "cgroup": create_cgroup(profile_name, profile),
+    }
+
+
+# The ulimit option for each rlimit and the unit it takes, in bytes or counts
+ULIMIT_OPTIONS = {"RLIMIT_CPU": ("t", 1), "RLIMIT_AS": ("v", 1024), "RLIMIT_NOFILE": ("n", 1)}
+
+
+def sandbox_command(sandbox, command):
+    # Wraps command in a shell that joins the cgroup and lowers the limits
+    # before it execs the command. preexec_fn would run Python between fork
+    # and exec, which can deadlock when other threads hold locks, so no
+    # Python runs in the child at all.
+    steps = []
+    if sandbox["cgroup"] is not None:
+        # "0" is the writing process, the shell that then becomes command
+        steps.append(f"echo 0 > {shlex.quote(os.path.join(sandbox['cgroup'], 'cgroup.procs'))} || exit 126")
+    for resource_name, (soft, hard) in sandbox["rlimits"]:
+        option, unit = ULIMIT_OPTIONS[resource_name]
+        # Soft first: lowering the hard limit below the soft one fails.
+        # A limit that cannot be set is skipped, as setrlimit errors were.
+        steps.append(f"ulimit -S -{option} {soft // unit} 2>/dev/null")
+        steps.append(f"ulimit -H -{option} {hard // unit} 2>/dev/null")
+    if not steps:
+        return command
+    return ["/bin/sh", "-c", "; ".join(steps + ['exec "$@"']), "sandbox"] + list(command)
+
+
+def check_executable(command, cwd=None, env=None):
+    # The wrapping shell reports a missing command as exit code 127, while
+    # callers expect the FileNotFoundError Popen raises
+    program = command[0]
+    if os.sep in program:
+        found = os.access(os.path.join(cwd or ".", program), os.X_OK)
+    else:
+        found = shutil.which(program, path=(env or os.environ).get("PATH", os.defpath)) is not None
+    if not found:
+        raise FileNotFoundError(errno.ENOENT, "No such file or directory", program)
+
+
+def launch(command, profile="command", **kwargs):
+    # Starts command in its own session inside the profile's sandbox. The
+    # returned Popen carries the sandbox for release_sandbox().
+    sandbox = create_sandbox(profile)
+    try:
+        check_executable(command, kwargs.get("cwd"), kwargs.get("env"))
+        p = subprocess.Popen(sandbox_command(sandbox, command), start_new_session=True, **kwargs)
+    except BaseException:
+        release_sandbox(sandbox)
+        raise
+    p.sandbox = sandbox
+    return p
+
+
+def kill_sandbox(sandbox):
+    # Kills whatever still runs in the command's cgroup, for commands whose
+    # process group is not known
+    if sandbox["cgroup"] is None:
+        return
+    try:
+        with open(os.path.join(sandbox["cgroup"], "cgroup.kill"), "w") as f:
+            f.write("1")
+        return
+    except OSError:
+        # cgroup.kill needs Linux 5.14
+        pass
+    try:
+        with open(os.path.join(sandbox["cgroup"], "cgroup.procs")) as f:
+            pids = [int(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def kill_process_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # It has already exited
+        pass
+
+
+def release_sandbox(sandbox, returncode=None, error=""):
+    # Removes the command's cgroup and returns the limit that stopped it
+    limit = None
+    applied = {name for name, resource_name in RLIMITS.items() if resource_name in dict(sandbox["rlimits"])}
+    if sandbox["cgroup"] is not None:
+        if sandbox["profile"]["processes"] is not None:
+            applied.add("processes")
+        try:
+            with open(os.path.join(sandbox["cgroup"], "memory.events")) as f:
+                events = dict(line.split() for line in f)
+            if int(events.get("oom_kill", 0)) > 0:
+                limit = "memory_bytes"
+            # Forks refused because pids.max was reached
+            with open(os.path.join(sandbox["cgroup"], "pids.events")) as f:
+                events = dict(line.split() for line in f)
+            if limit is None and int(events.get("max", 0)) > 0:
+                limit = "processes"
+            os.rmdir(sandbox["cgroup"])
+        except (OSError, ValueError):
+            pass
+    if limit is None and returncode is not None and returncode != 0:
+        if "cpu_seconds" in applied and returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU):
+            limit = "cpu_seconds"
+        else:
+            for name, pattern in LIMIT_MESSAGES.items():
+                if name in applied and pattern.search(error):
+                    limit = name
+                    break
+    return limit
+
+
+################### OUTPUT CAPTURE ###################
+# Wall clock limit for a script unless the model asks for another
+SCRIPT_TIMEOUT = 300
+# Output kept from each stream: the start, and a ring buffer of the end
+OUTPUT_HEAD_BYTES = 16 * 1024
+OUTPUT_TAIL_BYTES = 48 * 1024
+# Mirror command output to the terminal while it runs
+ECHO_OUTPUT = os.environ.get("ECHO_OUTPUT", "1") != "0"
+
+
+class OutputBuffer:
+    def __init__(self, head_bytes=OUTPUT_HEAD_BYTES, tail_bytes=OUTPUT_TAIL_BYTES):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        self.tail += data
+        if len(self.tail) > self.tail_bytes:
+            del self.tail[: len(self.tail) - self.tail_bytes]
+
+    def text(self):
+        text = self.head.decode(errors="replace")
+        omitted = self.total - len(self.head) - len(self.tail)
+        if omitted:
+            text += f"\n... [{omitted} bytes omitted] ...\n"
+        return text + self.tail.decode(errors="replace")
+
+
+def capture(streams, deadline=None, echo=None):
+    # Reads the given {file descriptor: terminal stream} pipes until they all
+    # close or the deadline passes. Returns their OutputBuffers and whether
+    # the deadline was hit.
+    echo = ECHO_OUTPUT if echo is None else echo
+    buffers = {fd: OutputBuffer() for fd in streams}
+    decoders = {fd: codecs.getincrementaldecoder("utf-8")(errors="replace") for fd in streams}
+    with selectors.DefaultSelector() as selector:
+        for fd in streams:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return buffers, True
+            for key, _ in selector.select(timeout):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fd)
+                    continue
+                buffers[key.fd].write(data)
+                if echo:
+                    streams[key.fd].write(decoders[key.fd].decode(data))
+                    streams[key.fd].flush()
+    return buffers, False
+
+
+def run_captured(command, timeout=None, cwd=None, profile="script", echo=None):
+    start = time.monotonic()
+    p = launch(
+        command,
+        profile=profile,
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
     )
+    deadline = None if timeout is None else start + timeout
+    stdout, stderr = p.stdout.fileno(), p.stderr.fileno()
+    buffers, timed_out = capture({stdout: sys.stdout, stderr: sys.stderr}, deadline, echo)
+    if timed_out:
+        os.killpg(p.pid, signal.SIGKILL)
+    p.wait()
+    p.stdout.close()
+    p.stderr.close()
+    result = {
+        "output": buffers[stdout].text(),
+        "error": buffers[stderr].text(),
+        "exit_code": p.returncode,
+        "elapsed_seconds": round(time.monotonic() - start, 3),
+    }
+    finish_result(result, p.sandbox, timeout, timed_out)
+    return result
 
-    # Wait for the prompt to come up
-    time.sleep(5)
 
-    # Helper function for interacting with the terminal
-    def send_input(process, bytes):
-        process.stdin.write(bytes)
-        process.stdin.flush()
-        time.sleep(1)
+def finish_result(result, sandbox, timeout, timed_out):
+    # Adds the reason a command was stopped, if it was
+    limit = release_sandbox(sandbox, result["exit_code"], result["error"])
+    if timed_out:
+        result["error"] += f"\nKilled after exceeding the {timeout} second time limit."
+        result["timed_out"] = True
+    elif limit is not None:
+        result["error"] += f"\nStopped by the {limit} limit ({sandbox['profile'][limit]})."
+        result["limit_exceeded"] = limit
 
-    # What would you like to do? [Create & configure a new site]
-    send_input(p, b"\x1b[B\n")
 
-    # Team [DevinTC]
-    send_input(p, b"\n")
+################### FORK SERVER ###################
+# Repeated script runs fork from a warm interpreter per venv that has
+# already imported the heavy modules below
+FORKSERVER_ENABLED = os.environ.get("FORKSERVER", "1") != "0"
+FORKSERVER_PRELOAD = os.environ.get("FORKSERVER_PRELOAD", "numpy,pandas,matplotlib").split(",")
+FORKSERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "forkserver.py")
+# Sockets and logs of the servers. Anyone who can connect can run anything,
+# so only this user may enter the directory.
+FORKSERVER_DIR = os.path.join(CACHE_DIR, "forkservers")
+
+
+class ForkServer:
+    def __init__(self, python, modules=FORKSERVER_PRELOAD):
+        self.python = python
+        self.stamp = self.site_packages_stamp()
+        key = hashlib.sha1(f"{os.path.abspath(python)}:{self.stamp}".encode()).hexdigest()[:16]
+        os.makedirs(FORKSERVER_DIR, mode=0o700, exist_ok=True)
+        os.chmod(FORKSERVER_DIR, 0o700)
+        self.socket_path = os.path.join(FORKSERVER_DIR, f"{key}.sock")
+        with open(f"{self.socket_path}.log", "ab") as log:
+            self.process = launch(
+                [python, FORKSERVER_SCRIPT, self.socket_path] + [module for module in modules if module],
+                profile="service",
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+            )
+
+    def site_packages_stamp(self):
+        # Installing or removing packages changes these directories, and a
+        # server that preloaded the old versions must not be used any more
+        venv_location = os.path.dirname(os.path.dirname(self.python))
+        stamps = []
+        for root in (os.path.join(venv_location, "lib"), os.path.join(venv_location, "Lib")):
+            if os.path.isdir(root):
+                for name in os.listdir(root):
+                    site_packages = os.path.join(root, name, "site-packages")
+                    if os.path.isdir(site_packages):
+                        stamps.append(os.stat(site_packages).st_mtime_ns)
+        return tuple(stamps)
+
+    def is_current(self):
+        return self.process.poll() is None and self.site_packages_stamp() == self.stamp
+
+    def run(self, argv, timeout=None):
+        # Returns None when the server is not ready so the caller can spawn
+        start = time.monotonic()
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.socket_path)
+        except OSError:
+            connection.close()
+            return None
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        # The child puts itself in the sandbox before running the script
+        sandbox = create_sandbox("script")
+        request = {"argv": argv, "cwd": os.getcwd(), "limits": sandbox["rlimits"], "cgroup": sandbox["cgroup"]}
+        try:
+            socket.send_fds(connection, [json.dumps(request).encode()], [stdout_write, stderr_write])
+        except OSError:
+            for fd in (stdout_read, stdout_write, stderr_read, stderr_write):
+                os.close(fd)
+            connection.close()
+            release_sandbox(sandbox)
+            return None
+        os.close(stdout_write)
+        os.close(stderr_write)
+        replies = connection.makefile("r")
+        try:
+            started = self.read_reply(replies, "pid")
+            if started is None:
+                # The server went away before it could report the script
+                # as started; if it forked anyway, the child is in the cgroup
+                kill_sandbox(sandbox)
+                release_sandbox(sandbox)
+                return None
+            deadline = None if timeout is None else start + timeout
+            buffers, timed_out = capture({stdout_read: sys.stdout, stderr_read: sys.stderr}, deadline)
+            if timed_out:
+                # The child leads its own session
+                kill_process_group(started["pid"])
+            finished = self.read_reply(replies, "exit_code")
+            if finished is None:
+                # The server went away while the script ran. The script's
+                # output has been shown already, so it is not run again.
+                kill_process_group(started["pid"])
+                kill_sandbox(sandbox)
+            exit_code = None if finished is None else finished["exit_code"]
+        finally:
+            os.close(stdout_read)
+            os.close(stderr_read)
+            replies.close()
+            connection.close()
+        result = {
+            "output": buffers[stdout_read].text(),
+            "error": buffers[stderr_read].text(),
+            "exit_code": exit_code,
+            "elapsed_seconds": round(time.monotonic() - start, 3),
+            "startup": {
+                "mode": "forkserver",
+                "preloaded": started["preloaded"],
+                # Import time each run would otherwise pay itself
+                "saved_seconds": started["preload_seconds"],
+                # Random number generators are reseeded in every run, but
+                # str and bytes hashes use the server's seed, so set and
+                # dict order can repeat between runs
+                "hash_seed": "shared with other runs in this venv",
+            },
+        }
+        if finished is None:
+            result["error"] += "\nThe fork server stopped while the script ran, so its exit code is unknown."
+        finish_result(result, sandbox, timeout, timed_out)
+        return result
+
+    @staticmethod
+    def read_reply(replies, key):
+        # Returns the server's next reply, or None if the server is gone or
+        # the reply lacks the key
+        try:
+            reply = json.loads(replies.readline())
+        except (OSError, ValueError):
+            return None
+        return reply if isinstance(reply, dict) and key in reply else None
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        release_sandbox(self.process.sandbox)
+
 
+class ForkServers:
+    def __init__(self):
+        self.servers = {}
+        self.lock = threading.Lock()
+
+    def run(self, python, argv, timeout=None):
+        # The first run for a venv starts its server and spawns normally
+        # while the server warms up
+        if not os.path.exists(python):
+            return None
+        key = os.path.abspath(python)
+        with self.lock:
+            server = self.servers.get(key)
+            if server is None or not server.is_current():
+                if server is not None:
+                    server.stop()
+                self.servers[key] = ForkServer(python)
+                return None
+        return server.run(argv, timeout)
+
+    def stop_all(self):
+        with self.lock:
+            servers, self.servers = list(self.servers.values()), {}
+        for server in servers:
+            server.stop()
+
+
+fork_servers = ForkServers()
+atexit.register(fork_servers.stop_all)
+
+
+################### INTERACTIVE COMMANDS ###################
+# The prompts `netlify deploy` shows for a directory that is not linked to a
+# site yet, and the keys that answer them
+NETLIFY_PROMPTS = [
+    # What would you like to do? [Create & configure a new site]
+    ("site_choice", re.compile(r"What would you like to do\?"), b"\x1b[B\n"),
+    # Team [DevinTC]
+    ("team", re.compile(r"Team:"), b"\n"),
     # Site name (leave blank for a random name; you can change it later) []
-    send_input(p, b"\n")
+    ("site_name", re.compile(r"Site name \(leave blank"), b"\n"),
+]
+# Longest the command may go without printing anything
+INTERACTIVE_IDLE_TIMEOUT = 120
+ANSI_ESCAPE = re.compile(r"\x1b(\[[0-?]*[ -/]*[@-~]|\][^\x07]*\x07|[@-Z\\-_])")
 
-    output, error = p.communicate()
-    return json.dumps({"output": str(output), "error": str(error)})
 
+class InteractiveProcess:
+    # Runs a command on a pseudo-terminal so prompt libraries behave as they
+    # would for a person, and reads its output as it arrives
+    def __init__(self, command, cwd=None):
+        master, slave = pty.openpty()
+        # A wide terminal keeps prompts from being wrapped across lines
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", 50, 200, 0, 0))
+        self.process = launch(command, profile="node", cwd=cwd, stdin=slave, stdout=slave, stderr=slave)
+        os.close(slave)
+        self.master = master
+        self.transcript = bytearray()
+        # Output not yet matched against a prompt
+        self.pending = ""
+        self.closed = False
+        self.limit_exceeded = None
 
-def redeploy_app_to_netlify(args):
-    # Decode arguments
-    directory = args.get("directory")
-    # Build the React app
-    p = subprocess.Popen(["npm", "run", "build"], cwd=f"{directory}/my-app")
-    p.wait()
-    # Deploy to netlify
-    p = subprocess.Popen(
-        ["netlify", "deploy", "--dir", "./build", "--prod"],
-        cwd=f"{directory}/my-app",
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    output, error = p.communicate()
-    return json.dumps({"output": str(output), "error": str(error)})
+    def read(self, timeout):
+        # Returns False once the command has closed its terminal
+        if self.closed:
+            return False
+        ready, _, _ = select.select([self.master], [], [], timeout)
+        if not ready:
+            raise TimeoutError(f"No output for {timeout} seconds")
+        try:
+            data = os.read(self.master, 65536)
+        except OSError:
+            # Linux reports EIO once the other side of the pty is gone
+            data = b""
+        if not data:
+            self.closed = True
+            os.close(self.master)
+            return False
+        self.transcript += data
+        self.pending += ANSI_ESCAPE.sub("", data.decode(errors="replace"))
+        return True
+
+    def interact(self, prompts, idle_timeout=INTERACTIVE_IDLE_TIMEOUT):
+        # Answers each prompt the moment it appears and returns how long the
+        # command took to reach each one and to finish after the last
+        timings = {}
+        last = time.perf_counter()
+        remaining = list(prompts)
+        while self.read(idle_timeout):
+            for prompt in remaining:
+                name, pattern, answer = prompt
+                if pattern.search(self.pending):
+                    now = time.perf_counter()
+                    timings[name] = round(now - last, 3)
+                    last = now
+                    self.pending = ""
+                    os.write(self.master, answer)
+                    remaining.remove(prompt)
+                    break
+        timings["finish"] = round(time.perf_counter() - last, 3)
+        return timings
+
+    def output(self):
+        return ANSI_ESCAPE.sub("", self.transcript.decode(errors="replace"))
 
+    def kill(self):
+        # The command runs in its own session, so this reaches its children too
+        if self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGKILL)
 
+    def wait(self):
+        while self.read(INTERACTIVE_IDLE_TIMEOUT):
+            pass
+        returncode = self.process.wait()
+        self.limit_exceeded = release_sandbox(self.process.sandbox, returncode, self.output())
+        return returncode
+
+
+@tool(
+    description="""Create a Python virtual environment for future code development.
+    Please include contents for any requirements file that will be installed using pip.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "directory": {
+                "type": "string",
+                "description": """The directory in which the code development will take place. Please preface
+                this directory with 'auto/' and end with a suffix that briefly describes the coding project.""",
+            },
+            "requirements_content": {
+                "type": "string",
+                "description": """The contents of the requirements.txt file that will be called
+                during a pip install command.""",
+            },
+        },
+        "required": ["directory", "requirements_content"],
+    },
+)
 def create_virtual_env(args):
     # Decode arguments
     directory = args.get("directory")
     requirements_content = args.get("requirements_content")
     # Create the directory
-    if not os.path.isdir(directory):
-        subprocess.run(["mkdir", directory])
+    os.makedirs(directory, exist_ok=True)
     # Write the requirements
     f = open(f"{directory}/requirements.txt", "w")
     f.write(requirements_content)
     f.close()
     # Create the environment and install relevant requirements
     venv_location = os.path.join(directory, "venv")
-    venv.create(venv_location, with_pip=True)
-    p = subprocess.Popen(
-        [f"{directory}/venv/bin/pip", "install", "-r", f"{directory}/requirements.txt"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    output, error = p.communicate()
+    start = time.perf_counter()
+    if os.path.exists(venv_location):
+        # Never replace an environment the project already has
+        venv.create(venv_location, with_pip=True)
+        output, error, _ = pip_install(venv_location, f"{directory}/requirements.txt")
+        template = "skipped"
+    else:
+        template_location, output, error, template = get_venv_template(requirements_content)
+        materialize_venv(template_location, venv_location)
     print(f"Successfully created a virtual environment in {directory}")
-    return json.dumps({"output": str(output), "error": str(error)})
+    return json.dumps(
+        {
+            "output": str(output),
+            "error": str(error),
+            "template": template,
+            "elapsed_seconds": round(time.perf_counter() - start, 3),
+        }
+    )
+
+
+################### VIRTUAL ENVIRONMENT TEMPLATES ###################
+# Fully installed environments keyed by their requirements, copied into new
+# projects with hardlinks instead of being rebuilt
+VENV_STORE_DIR = os.path.join(CACHE_DIR, "venvs")
+# Every wheel ever installed, so repeat installs work offline
+WHEELHOUSE_DIR = os.path.join(CACHE_DIR, "wheelhouse")
+# Least recently used templates are removed once the store grows past this
+VENV_STORE_MAX_BYTES = int(os.environ.get("VENV_STORE_MAX_BYTES", str(5 * 1024**3)))
+REQUIREMENT_NAME = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$")
+
+
+def normalize_requirements(requirements_content):
+    # Order, case, comments and spacing do not change what gets installed
+    requirements = set()
+    for line in requirements_content.splitlines():
+        line = re.sub(r"(^|\s)#.*$", "", line).strip()
+        if not line:
+            continue
+        match = REQUIREMENT_NAME.match(line)
+        if match:
+            name, rest = match.groups()
+            line = re.sub(r"[-_.]+", "-", name).lower() + rest.replace(" ", "")
+        requirements.add(line)
+    return "\n".join(sorted(requirements))
+
+
+def venv_template_key(requirements_content):
+    python_version = f"{sys.implementation.name}-{sys.version}-{os.uname().machine}"
+    content = f"{python_version}\n{normalize_requirements(requirements_content)}"
+    return hashlib.sha256(content.encode()).hexdigest()[:24]
+
+
+def pip_install(venv_location, requirements_file, offline=False):
+    command = [f"{venv_location}/bin/pip", "install", "--find-links", WHEELHOUSE_DIR, "-r", requirements_file]
+    if offline:
+        command.insert(2, "--no-index")
+    result = run_captured(command, profile="pip", echo=False)
+    return result["output"], result["error"], result["exit_code"]
+
+
+def build_venv_template(location, requirements_content):
+    venv.create(location, with_pip=True)
+    requirements_file = os.path.join(os.path.dirname(location), "requirements.txt")
+    with open(requirements_file, "w") as f:
+        f.write(normalize_requirements(requirements_content) + "\n")
+    # Try the wheelhouse alone first, then fill it from the index
+    output, error, returncode = pip_install(location, requirements_file, offline=True)
+    if returncode != 0:
+        os.makedirs(WHEELHOUSE_DIR, exist_ok=True)
+        result = run_captured(
+            [f"{location}/bin/pip", "wheel", "-w", WHEELHOUSE_DIR, "--find-links", WHEELHOUSE_DIR, "-r", requirements_file],
+            profile="pip",
+            echo=False,
+        )
+        output, error, returncode = pip_install(location, requirements_file, offline=result["exit_code"] == 0)
+    return output, error, returncode
+
+
+def get_venv_template(requirements_content):
+    # Returns the template location, pip output and whether it was reused
+    key = venv_template_key(requirements_content)
+    template_dir = os.path.join(VENV_STORE_DIR, key)
+    location = os.path.join(template_dir, "venv")
+    metadata_file = os.path.join(template_dir, "template.json")
+    os.makedirs(VENV_STORE_DIR, exist_ok=True)
+    # Other sessions may be building the same template
+    with open(os.path.join(VENV_STORE_DIR, f"{key}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(metadata_file):
+            os.utime(metadata_file)
+            return location, "Reused a cached environment for these requirements", "", "hit"
+        shutil.rmtree(template_dir, ignore_errors=True)
+        os.makedirs(template_dir)
+        output, error, returncode = build_venv_template(location, requirements_content)
+        if returncode != 0:
+            # Keep failed installs out of the store; the project still gets
+            # whatever did install
+            return location, output, error, "failed"
+        with open(metadata_file, "w") as f:
+            json.dump({"requirements": normalize_requirements(requirements_content), "size": directory_size(template_dir)}, f)
+    evict_venv_templates(keep=key)
+    return location, output, error, "built"
+
+
+def directory_size(directory):
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+
+def evict_venv_templates(keep=None):
+    templates = []
+    for key in os.listdir(VENV_STORE_DIR):
+        metadata_file = os.path.join(VENV_STORE_DIR, key, "template.json")
+        if key == keep or not os.path.exists(metadata_file):
+            continue
+        with open(metadata_file) as f:
+            size = json.load(f)["size"]
+        templates.append((os.path.getmtime(metadata_file), key, size))
+    total = sum(size for _, _, size in templates)
+    if keep is not None:
+        with open(os.path.join(VENV_STORE_DIR, keep, "template.json")) as f:
+            total += json.load(f)["size"]
+    for _, key, size in sorted(templates):
+        if total <= VENV_STORE_MAX_BYTES:
+            break
+        shutil.rmtree(os.path.join(VENV_STORE_DIR, key), ignore_errors=True)
+        total -= size
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Different filesystems or no hardlink support
+        copy_file_data(source, destination)
+
+
+def materialize_venv(template_location, venv_location):
+    template_location = os.path.abspath(template_location)
+    venv_location = os.path.abspath(venv_location)
+    old_path, new_path = template_location.encode(), venv_location.encode()
+    for root, dirs, files in os.walk(template_location):
+        relative = os.path.relpath(root, template_location)
+        target_root = os.path.normpath(os.path.join(venv_location, relative))
+        os.makedirs(target_root, exist_ok=True)
+        # Bytecode records the template's paths; let the project compile its own
+        dirs[:] = [name for name in dirs if name != "__pycache__"]
+        for name in dirs:
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), os.path.join(target_root, name))
+        for name in files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+                continue
+            if relative == "bin" or name == "pyvenv.cfg":
+                # Scripts and activation files embed the venv's own path
+                with open(source, "rb") as f:
+                    content = f.read()
+                if old_path in content:
+                    with open(target, "wb") as f:
+                        f.write(content.replace(old_path, new_path))
+                    shutil.copymode(source, target)
+                    continue
+            link_or_copy(source, target)
+
+
+################### BROWSER POOL ###################
+# Browsers are kept warm between calls instead of starting Chrome every time
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", "2"))
+# Seconds an unused browser may sit in the pool before it is shut down
+BROWSER_IDLE_TIMEOUT = float(os.environ.get("BROWSER_IDLE_TIMEOUT", "300"))
+# Set BROWSER_HEADLESS=0 to watch the browser work
+BROWSER_HEADLESS = os.environ.get("BROWSER_HEADLESS", "1") != "0"
+
+
+def create_browser():
+    options = webdriver.ChromeOptions()
+    if BROWSER_HEADLESS:
+        options.add_argument("--headless=new")
+    return webdriver.Chrome(options=options)
+
+
+class BrowserPool:
+    def __init__(
+        self, factory=create_browser, size=BROWSER_POOL_SIZE, idle_timeout=BROWSER_IDLE_TIMEOUT, broken_error=None
+    ):
+        self.factory = factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # The exception that marks a browser as broken. Selenium's
+        # WebDriverException unless given; only looked up once something
+        # is raised, so selenium is not imported for a stub factory.
+        self.broken_error = broken_error
+        # Idle browsers as (browser, time it was returned), most recent last
+        self.idle = []
+        # Browsers that exist right now, whether idle or checked out
+        self.live = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.reaper = None
+        self.stopped = threading.Event()
+
+    @contextmanager
+    def browser(self):
+        browser = self.checkout()
+        healthy = True
+        try:
+            yield browser
+        except self.broken_errors():
+            healthy = False
+            raise
+        finally:
+            self.checkin(browser, healthy)
+
+    def checkout(self):
+        while True:
+            with self.condition:
+                while not self.idle and self.live >= self.size and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    raise RuntimeError("The browser pool has been shut down")
+                if not self.idle:
+                    # Reserve a slot, then start the browser outside the lock
+                    self.live += 1
+                    break
+                browser, _ = self.idle.pop()
+            if self.is_healthy(browser):
+                return browser
+            self.discard(browser)
+        try:
+            return self.factory()
+        except Exception:
+            with self.condition:
+                self.live -= 1
+                self.condition.notify()
+            raise
+
+    def checkin(self, browser, healthy=True):
+        with self.condition:
+            if healthy and not self.closed:
+                self.idle.append((browser, time.monotonic()))
+                self.condition.notify()
+                self.start_reaper()
+                return
+        self.discard(browser)
+
+    def is_healthy(self, browser):
+        try:
+            browser.current_url
+            return True
+        except self.broken_errors():
+            return False
+
+    def broken_errors(self):
+        return self.broken_error or selenium_exceptions.WebDriverException
+
+    def discard(self, browser):
+        try:
+            browser.quit()
+        except Exception:
+            pass
+        with self.condition:
+            self.live -= 1
+            self.condition.notify()
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.condition:
+            expired = [browser for browser, last_used in self.idle if last_used < cutoff]
+            self.idle = [(browser, last_used) for browser, last_used in self.idle if last_used >= cutoff]
+        for browser in expired:
+            self.discard(browser)
+        return len(expired)
+
+    def start_reaper(self):
+        # Called with the condition held
+        if self.reaper is not None:
+            return
+
+        def reap():
+            # Sleeps on its own event, not the condition, so it never takes
+            # a wakeup meant for a blocked checkout
+            while not self.stopped.wait(timeout=max(self.idle_timeout / 2, 1)):
+                self.evict_idle()
+
+        self.reaper = threading.Thread(target=reap, name="browser-pool-reaper", daemon=True)
+        self.reaper.start()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+        self.stopped.set()
+        for browser, _ in idle:
+            self.discard(browser)
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
+
+
+################### TEXT BUDGETS ###################
+# Rough characters per token when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+TOKENIZER_ENCODING = "cl100k_base"
+tokenizer = None
+
+
+def get_tokenizer():
+    global tokenizer
+    if tokenizer is None and tiktoken is not None:
+        tokenizer = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    return tokenizer
+
+
+def count_tokens(text):
+    encoding = get_tokenizer()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_text(text, max_chars=None, max_tokens=None):
+    # Returns the text cut down to the budget and whether anything was cut
+    truncated = False
+    if max_chars is not None and len(text) > max_chars:
+        text, truncated = text[:max_chars], True
+    if max_tokens is not None:
+        encoding = get_tokenizer()
+        if encoding is None:
+            if len(text) > max_tokens * CHARS_PER_TOKEN:
+                text, truncated = text[: max_tokens * CHARS_PER_TOKEN], True
+        else:
+            tokens = encoding.encode(text, disallowed_special=())
+            if len(tokens) > max_tokens:
+                text, truncated = encoding.decode(tokens[:max_tokens]), True
+    return text, truncated
 
 
 ################### HELPER FUNCTIONS FOR WEBSITES ###################
-def remove_tags(html):
-    soup = BeautifulSoup(html, "html.parser")
+# "lxml" builds a tree with lxml, "stream" parses incrementally with the
+# standard library and stops once the budget is reached, "soup" is the old
+# BeautifulSoup path. "auto" picks lxml when it is installed.
+EXTRACT_BACKEND = os.environ.get("EXTRACT_BACKEND", "auto")
+# Hard cap on the text kept from a single page
+EXTRACT_MAX_CHARS = int(os.environ.get("EXTRACT_MAX_CHARS", "200000"))
+# Size of the pieces fed to the streaming parser
+EXTRACT_CHUNK_SIZE = 64 * 1024
+# Never visible to a reader
+INVISIBLE_TAGS = ("script", "style", "template", "svg")
+# Site chrome that surrounds the main content
+BOILERPLATE_TAGS = ("nav", "aside")
+# Only boilerplate outside of a <main> or <article>
+PAGE_CHROME_TAGS = ("header", "footer")
+CONTENT_TAGS = ("main", "article")
+BOILERPLATE_ROLES = ("navigation", "banner", "contentinfo", "complementary", "search")
+# Elements without an end tag, which therefore cannot open a skipped region
+VOID_TAGS = (
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"
+)
+
+
+class StreamingTextExtractor(HTMLParser):
+    def __init__(self, base_url="", max_chars=EXTRACT_MAX_CHARS, main_content=True):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.max_chars = max_chars
+        self.main_content = main_content
+        self.parts = []
+        self.length = 0
+        self.links = []
+        self.seen_links = set()
+        # Tag that opened the region being skipped and how deeply it is nested
+        self.skip_tag = None
+        self.skip_depth = 0
+        self.content_depth = 0
+        self.done = False
+
+    def is_skipped(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return False
+        if tag in INVISIBLE_TAGS:
+            return True
+        if not self.main_content:
+            return False
+        if tag in BOILERPLATE_TAGS or dict(attrs).get("role") in BOILERPLATE_ROLES:
+            return True
+        return tag in PAGE_CHROME_TAGS and self.content_depth == 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                link = urljoin(self.base_url, href)
+                if link not in self.seen_links:
+                    self.seen_links.add(link)
+                    self.links.append(link)
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+        elif self.is_skipped(tag, attrs):
+            self.skip_tag, self.skip_depth = tag, 1
+        elif tag in CONTENT_TAGS:
+            self.content_depth += 1
+
+    def handle_endtag(self, tag):
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if self.skip_depth == 0:
+                    self.skip_tag = None
+        elif tag in CONTENT_TAGS and self.content_depth > 0:
+            self.content_depth -= 1
+
+    def handle_data(self, data):
+        if self.skip_tag is not None or self.done:
+            return
+        data = data.strip()
+        if data:
+            self.parts.append(data)
+            self.length += len(data) + 1
+            if self.length >= self.max_chars:
+                self.done = True
+
+    def extract(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+            if self.done:
+                break
+        else:
+            self.close()
+        return " ".join(self.parts), self.links
+
+
+def iter_chunks(html, size=EXTRACT_CHUNK_SIZE):
+    for start in range(0, len(html), size):
+        yield html[start : start + size]
+
+
+def extract_with_stream(html, base_url, max_chars, main_content):
+    extractor = StreamingTextExtractor(base_url, max_chars, main_content)
+    return extractor.extract(iter_chunks(html))
+
+
+def extract_with_lxml(html, base_url, max_chars, main_content):
+    try:
+        try:
+            document = lxml_html.document_fromstring(html)
+        except ValueError:
+            # lxml refuses str input that carries an XML encoding declaration
+            document = lxml_html.document_fromstring(html.encode("utf-8"))
+    except etree.ParserError:
+        # Fragments with no elements at all
+        return extract_with_stream(html, base_url, max_chars, main_content)
+    links = []
+    seen_links = set()
+    for href in document.xpath("//a/@href"):
+        link = urljoin(base_url, href)
+        if link not in seen_links:
+            seen_links.add(link)
+            links.append(link)
+    etree.strip_elements(document, *INVISIBLE_TAGS, with_tail=False)
+    etree.strip_elements(document, etree.Comment, with_tail=False)
+    if main_content:
+        # Same rule as the streaming backend: drop the chrome, keep the rest,
+        # so pages with one <article> per post keep every post
+        boilerplate = document.xpath(
+            " | ".join(
+                [f"//{tag}" for tag in BOILERPLATE_TAGS]
+                + [f"//{tag}[not(ancestor::main or ancestor::article)]" for tag in PAGE_CHROME_TAGS]
+                + [f"//*[@role='{role}']" for role in BOILERPLATE_ROLES]
+            )
+        )
+        for element in boilerplate:
+            parent = element.getparent()
+            if parent is not None:
+                element.drop_tree()
+    parts = []
+    length = 0
+    for data in document.itertext():
+        data = data.strip()
+        if data:
+            parts.append(data)
+            length += len(data) + 1
+            if length >= max_chars:
+                break
+    return " ".join(parts), links
+
+
+def extract_with_soup(html, base_url, max_chars, main_content):
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link = urljoin(base_url, anchor["href"])
+        if link not in links:
+            links.append(link)
     for data in soup(["style", "script"]):
         data.decompose()
-    return " ".join(soup.stripped_strings)
+    return " ".join(soup.stripped_strings), links
+
+
+EXTRACT_BACKENDS = {
+    "lxml": extract_with_lxml,
+    "stream": extract_with_stream,
+    "soup": extract_with_soup,
+}
+
+
+def extract_page(html, base_url="", max_chars=EXTRACT_MAX_CHARS, max_tokens=None, main_content=True, backend=None):
+    # Returns the visible text and the deduplicated absolute links of a page
+    backend = backend or EXTRACT_BACKEND
+    if backend == "auto":
+        backend = "lxml" if lxml_html is not None else "stream"
+    if not html.strip():
+        return "", []
+    text, links = EXTRACT_BACKENDS[backend](html, base_url, max_chars, main_content)
+    text, _ = truncate_text(text, max_chars, max_tokens)
+    return text, links
+
+
+def remove_tags(html):
+    return extract_page(html)[0]
+
+
+# The search front end itself, www.google.com, google.co.uk and so on
+GOOGLE_SEARCH_HOST = re.compile(r"^(www\.)?google\.[a-z.]+$")
+# Its own pages: result pages, redirects, settings and sign-in
+GOOGLE_SEARCH_PATHS = ("/search", "/url", "/setprefs", "/preferences", "/advanced_search", "/webhp", "/imgres", "/sorry")
+# Hosts that only ever serve Google's page chrome, caches and ads. Other
+# subdomains like developers.google.com are real results.
+GOOGLE_CHROME_HOST = re.compile(
+    r"(^|\.)(gstatic\.com|googleusercontent\.com|googleadservices\.com|googlesyndication\.com)$"
+    r"|^(accounts|policies)\.google\.[a-z.]+$"
+)
+
+
+def is_google_chrome(parts):
+    host = parts.hostname or ""
+    if GOOGLE_CHROME_HOST.search(host):
+        return True
+    return bool(GOOGLE_SEARCH_HOST.match(host)) and (parts.path in ("", "/") or parts.path.startswith(GOOGLE_SEARCH_PATHS))
+
+
+def result_links(links):
+    # Keeps the outbound result links of a Google results page, in rank order
+    results = []
+    seen = set()
+    for link in links:
+        parts = urlsplit(link)
+        if GOOGLE_SEARCH_HOST.match(parts.hostname or "") and parts.path == "/url":
+            # Redirect wrappers carry the real target in q or url
+            query = parse_qs(parts.query)
+            link = (query.get("q") or query.get("url") or [""])[0]
+            parts = urlsplit(link)
+        if parts.scheme not in ("http", "https") or is_google_chrome(parts):
+            continue
+        key = normalize_url(link)
+        if key not in seen:
+            seen.add(key)
+            results.append(link)
+    return results
+
 
+def google_search(query):
+    url = f"https://www.google.com/search?q={quote_plus(query)}"
+    with browser_pool.browser() as browser:
+        browser.get(url)
+        # Get raw text and links from the page
+        text, links = extract_page(browser.page_source, browser.current_url)
+    return text, links
 
+
+@tool(
+    description="""Make a google search.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": """The query to search.""",
+            },
+        },
+        "required": ["query"],
+    },
+)
 def search_google(args):
     # Decode arguments
     query = args.get("query")
-    url = f"https://www.google.com/search?q={query.replace(' ', '+')}"
-    browser = webdriver.Chrome()
-    browser.get(url)
-    # Get raw text from the page
-    extracted_data = remove_tags(browser.page_source)
-    # Get links on the page
-    link_elements = browser.find_elements("xpath", "//a[@href]")
-    links = [link.get_attribute("href") for link in link_elements]
+    extracted_data, links = google_search(query)
     return json.dumps({"text_on_page": extracted_data, "url_links": links})
 
 
+################### HTTP FAST PATH ###################
+# Static pages are fetched over a pooled keep-alive session and only pages
+# that look like they need JavaScript are handed to the browser pool
+HTTP_TIMEOUT = 10
+HTTP_POOL_SIZE = 8
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/123.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+# Pages with less visible text than this are assumed to be rendered client side
+MIN_STATIC_TEXT_LENGTH = 200
+# Below this length a JavaScript warning or an empty app root means the real
+# content has not been rendered yet
+MAX_SHELL_TEXT_LENGTH = 2000
+JS_REQUIRED_MARKERS = re.compile(
+    r"(enable|requires?|turn on|need(s)? to enable)\s+javascript|javascript (is )?(required|disabled)",
+    re.IGNORECASE,
+)
+# Most page text handed back to the model in one tool call
+PAGE_TEXT_MAX_TOKENS = int(os.environ.get("PAGE_TEXT_MAX_TOKENS", "6000"))
+EMPTY_APP_ROOT = re.compile(r"<div[^>]+id=[\"'](root|app|__next|__nuxt)[\"'][^>]*>\s*</div>", re.IGNORECASE)
+
+
+def create_http_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HTTP_HEADERS)
+    return session
+
+
+http_session = None
+http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    # Created on first use so requests is only imported by sessions that fetch
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            http_session = create_http_session()
+        return http_session
+
+
+def needs_javascript(html, text):
+    if len(text) < MIN_STATIC_TEXT_LENGTH:
+        return True
+    if len(text) < MAX_SHELL_TEXT_LENGTH:
+        if EMPTY_APP_ROOT.search(html) or JS_REQUIRED_MARKERS.search(text):
+            return True
+    return False
+
+
+def fetch_with_http(url, etag=None, last_modified=None):
+    # Returns the extracted page, or None if the browser should be used instead.
+    # With validators from a cached copy this is a conditional GET.
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        response = get_http_session().get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    except requests.RequestException:
+        return None
+    if response.status_code == 304 and headers:
+        return {"not_modified": True}
+    if response.status_code >= 400:
+        return None
+    content_type = response.headers.get("Content-Type", "")
+    if "html" in content_type:
+        html = response.text
+        text, links = extract_page(html, response.url)
+        if needs_javascript(html, text):
+            return None
+    elif content_type.startswith(("text/", "application/json")):
+        # Plain text, JSON and similar documents are already readable
+        text, links = response.text, []
+    else:
+        return None
+    return {
+        "text": text,
+        "links": links,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def fetch_with_browser(url):
+    with browser_pool.browser() as browser:
+        browser.get(url)
+        # Get raw text and links from the page
+        text, links = extract_page(browser.page_source, browser.current_url)
+    return {"text": text, "links": links, "etag": None, "last_modified": None}
+
+
+################### URL CACHE ###################
+URL_CACHE_PATH = os.path.join(CACHE_DIR, "url_cache.sqlite3")
+# Seconds a cached page is served without asking the server again
+URL_CACHE_TTL = float(os.environ.get("URL_CACHE_TTL", str(24 * 60 * 60)))
+# Least recently used pages are dropped once the cache grows past this
+URL_CACHE_MAX_BYTES = int(os.environ.get("URL_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+# Query parameters that never change the content of a page
+TRACKING_PARAMETERS = ("utm_", "fbclid", "gclid")
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMETERS)
+    )
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(query), ""))
+
+
+class UrlCache:
+    def __init__(self, path=URL_CACHE_PATH, ttl=URL_CACHE_TTL, max_bytes=URL_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # Opened on first use so importing this module never touches the disk
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    links TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetch_method TEXT,
+                    fetched_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access)")
+        return self.connection
+
+    def get(self, url):
+        key = normalize_url(url)
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute(
+                "SELECT text, links, etag, last_modified, fetch_method, fetched_at FROM pages WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE pages SET last_access = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+        text, links, etag, last_modified, fetch_method, fetched_at = row
+        return {
+            "text": text,
+            "links": json.loads(links),
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetch_method": fetch_method,
+            "fetched_at": fetched_at,
+        }
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def put(self, url, page):
+        key = normalize_url(url)
+        links = json.dumps(page["links"])
+        size = len(page["text"].encode()) + len(links.encode())
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, page["text"], links, page["etag"], page["last_modified"], page["fetch_method"], now, now, size),
+            )
+            self.evict(connection)
+            connection.commit()
+
+    def mark_revalidated(self, url):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("UPDATE pages SET fetched_at = ? WHERE key = ?", (time.time(), normalize_url(url)))
+            connection.commit()
+
+    def evict(self, connection):
+        # Called with the lock held
+        (total,) = connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()
+        if total <= self.max_bytes:
+            return
+        for key, size in connection.execute("SELECT key, size FROM pages ORDER BY last_access").fetchall():
+            connection.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def count(self, *names):
+        # fetch_page runs on several threads at once for search_and_read
+        with self.lock:
+            for name in names:
+                setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+            }
+
+
+url_cache = UrlCache()
+
+
+def fetch_page(url):
+    start = time.perf_counter()
+    entry = url_cache.get(url)
+    if entry is not None and url_cache.is_fresh(entry):
+        url_cache.count("hits")
+        cache_status, page = "hit", entry
+    else:
+        validators = (entry["etag"], entry["last_modified"]) if entry is not None else (None, None)
+        page = fetch_with_http(url, *validators)
+        if page is not None and page.get("not_modified"):
+            url_cache.mark_revalidated(url)
+            url_cache.count("hits", "revalidations")
+            cache_status, page = "revalidated", entry
+        else:
+            url_cache.count("misses")
+            cache_status = "miss"
+            if page is not None:
+                page["fetch_method"] = "http"
+            else:
+                page = fetch_with_browser(url)
+                page["fetch_method"] = "browser"
+            url_cache.put(url, page)
+    return {
+        "text": page["text"],
+        "links": page["links"],
+        "fetch_method": page["fetch_method"],
+        "cache": cache_status,
+        "elapsed_seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+################### PASSAGE RETRIEVAL ###################
+# Pages are split into overlapping word windows that are ranked with BM25
+CHUNK_WORDS = 120
+CHUNK_OVERLAP_WORDS = 30
+DEFAULT_TOP_K = 5
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Number of page indexes kept in memory for follow-up questions
+MAX_CACHED_INDEXES = 32
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+def chunk_text(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP_WORDS):
+    # Returns (start offset, end offset) pairs into text
+    words = [match.span() for match in re.finditer(r"\S+", text)]
+    chunks = []
+    step = max(chunk_words - overlap, 1)
+    for first in range(0, len(words), step):
+        last = min(first + chunk_words, len(words)) - 1
+        chunks.append((words[first][0], words[last][1]))
+        if last == len(words) - 1:
+            break
+    return chunks
+
+
+class Bm25Index:
+    def __init__(self, text):
+        self.text = text
+        self.chunks = chunk_text(text)
+        self.term_counts = [Counter(tokenize(text[start:end])) for start, end in self.chunks]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        document_frequency = Counter()
+        for counts in self.term_counts:
+            document_frequency.update(counts.keys())
+        total = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def search(self, query, top_k=DEFAULT_TOP_K):
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = []
+        for index, counts in enumerate(self.term_counts):
+            score = 0.0
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[index] / self.average_length)
+            for term in terms:
+                frequency = counts.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+            if score > 0:
+                scores.append((score, index))
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        passages = []
+        for score, index in scores[:top_k]:
+            start, end = self.chunks[index]
+            passages.append({"text": self.text[start:end], "start": start, "end": end, "score": round(score, 3)})
+        return passages
+
+
+class IndexCache:
+    def __init__(self, max_indexes=MAX_CACHED_INDEXES):
+        self.max_indexes = max_indexes
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url, text):
+        # Keyed on the text as well so a refreshed page gets a fresh index
+        key = (normalize_url(url), hashlib.sha1(text.encode()).hexdigest())
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None:
+                self.indexes.move_to_end(key)
+                return index
+        index = Bm25Index(text)
+        with self.lock:
+            self.indexes[key] = index
+            while len(self.indexes) > self.max_indexes:
+                self.indexes.popitem(last=False)
+        return index
+
+
+index_cache = IndexCache()
+
+
+@tool(
+    description="""Search a website to get relevant information. Pass a query to get back only
+    the passages of the page that are relevant to it.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "url": {
+                "type": "string",
+                "description": """The URL of the website to search.""",
+            },
+            "query": {
+                "type": "string",
+                "description": """What you are looking for on the page. When given, only the most relevant
+                passages are returned instead of the whole page. Ask follow-up questions about the same
+                page with a new query.""",
+            },
+            "top_k": {
+                "type": "integer",
+                "description": """The number of passages to return with a query. Defaults to 5.""",
+            },
+        },
+        "required": ["url"],
+    },
+)
 def search_website(args):
     # Decode arguments
     url = args.get("url")
-    browser = webdriver.Chrome()
-    browser.get(url)
-    # Get raw text from the page
-    extracted_data = remove_tags(browser.page_source)
-    return json.dumps({"text_on_page": extracted_data})
-
-
-# All available functions
-available_functions = {
-    # For working with files
-    "copy_file": copy_file,
-    "write_file": write_file,
-    # For running
-    "run_python_script": run_python_script,
-    # For opening files
-    "open_png_file": open_png_file,
-    # Virtual environments
-    "create_virtual_env": create_virtual_env,
-    # Create project directory
-    "create_project_directory": create_project_directory,
-    "initialize_react_app": initialize_react_app,
-    "deploy_app_to_netlify": deploy_app_to_netlify,
-    "redeploy_app_to_netlify": redeploy_app_to_netlify,
-    "search_google": search_google,
-    "search_website": search_website,
+    query = args.get("query")
+    top_k = int(args.get("top_k", DEFAULT_TOP_K))
+    page = fetch_page(url)
+    result = {
+        "fetch_method": page["fetch_method"],
+        "cache": page["cache"],
+        "cache_stats": url_cache.stats(),
+        "elapsed_seconds": page["elapsed_seconds"],
+    }
+    if query:
+        # Only hand back the passages that matter for the question
+        passages = index_cache.get(url, page["text"]).search(query, top_k)
+        result["query"] = query
+        result["passages"] = passages
+    else:
+        text, truncated = truncate_text(page["text"], max_tokens=PAGE_TEXT_MAX_TOKENS)
+        result["text_on_page"] = text
+        result["truncated"] = truncated
+    return json.dumps(result)
+
+
+# Results read by search_and_read unless the model asks for more or fewer
+SEARCH_READ_TOP_K = 3
+# Passages kept from each result page
+SEARCH_READ_PASSAGES = 2
+# Size of the whole digest returned to the model
+SEARCH_READ_MAX_TOKENS = int(os.environ.get("SEARCH_READ_MAX_TOKENS", "4000"))
+# Pages that take longer than this are left out of the digest
+SEARCH_READ_TIMEOUT = 30
+
+
+@tool(
+    description="""Make a google search and read the top results in one step. Returns the most relevant
+    passages of each result page for the query. Prefer this over search_google followed by search_website.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": """The query to search.""",
+            },
+            "top_k": {
+                "type": "integer",
+                "description": """The number of result pages to read. Defaults to 3.""",
+            },
+        },
+        "required": ["query"],
+    },
+)
+def search_and_read(args):
+    # Decode arguments
+    query = args.get("query")
+    top_k = int(args.get("top_k", SEARCH_READ_TOP_K))
+    start = time.perf_counter()
+    _, links = google_search(query)
+    links = result_links(links)[:top_k]
+    # Read every result at once instead of one model round trip per page
+    executor = ThreadPoolExecutor(max_workers=max(len(links), 1), thread_name_prefix="search-read")
+    futures = [executor.submit(fetch_page, link) for link in links]
+    wait(futures, timeout=SEARCH_READ_TIMEOUT)
+    # Slow pages finish in the background and still land in the URL cache
+    executor.shutdown(wait=False)
+    tokens_per_result = SEARCH_READ_MAX_TOKENS // max(len(links), 1)
+    results = []
+    for rank, (link, future) in enumerate(zip(links, futures), start=1):
+        result = {"rank": rank, "url": link}
+        if not future.done():
+            result["error"] = f"Timed out after {SEARCH_READ_TIMEOUT} seconds"
+        elif future.exception() is not None:
+            result["error"] = str(future.exception())
+        else:
+            page = future.result()
+            passages = index_cache.get(link, page["text"]).search(query, SEARCH_READ_PASSAGES)
+            if passages:
+                excerpt = " ... ".join(passage["text"] for passage in passages)
+            else:
+                excerpt = page["text"]
+            result["excerpt"], result["truncated"] = truncate_text(excerpt, max_tokens=tokens_per_result)
+            result["fetch_method"] = page["fetch_method"]
+        results.append(result)
+    return json.dumps(
+        {
+            "query": query,
+            "results": results,
+            "elapsed_seconds": round(time.perf_counter() - start, 3),
+        }
+    )
+
+
+################### PROJECT SEARCH ###################
+# Trigram index over the text files of a project, kept in memory and
+# updated as tools write files plus a cheap mtime scan before each search
+SEARCH_EXCLUDED_DIRS = {"node_modules", ".git", "venv", ".venv", "__pycache__", "build", "dist", ".cache"}
+SEARCH_MAX_FILE_BYTES = 1024 * 1024
+# Searches within this many seconds of the last scan trust the hooks alone
+SEARCH_RESCAN_SECONDS = 1.0
+SEARCH_MAX_RESULTS = 50
+SEARCH_LINE_CHARS = 200
+
+
+def trigrams(text):
+    return set(map("".join, zip(text, text[1:], text[2:])))
+
+
+def required_literals(pattern, flags=0):
+    # Literal strings every match of the regex must contain. An empty list
+    # means the index cannot narrow the search.
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return []
+    literals, run = [], []
+    for op, value in parsed:
+        if op is sre_constants.LITERAL:
+            run.append(chr(value))
+            continue
+        if op is sre_constants.MAX_REPEAT or op is sre_constants.MIN_REPEAT:
+            low, _, item = value
+            if low > 0 and len(item) == 1 and item[0][0] is sre_constants.LITERAL:
+                # "a+" still needs one "a"; the run ends after it either way
+                run.append(chr(item[0][1]))
+        literals.append("".join(run))
+        run = []
+    literals.append("".join(run))
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+class ProjectIndex:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.files = {}
+        self.postings = defaultdict(set)
+        self.last_scan = 0
+        self.lock = threading.RLock()
+
+    def contains(self, path):
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def index_file(self, path):
+        # Adds, refreshes or drops one file. Binary and huge files are skipped.
+        with self.lock:
+            self.forget(path)
+            try:
+                stat = os.stat(path)
+                if stat.st_size > SEARCH_MAX_FILE_BYTES:
+                    return
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                return
+            if b"\0" in data[:8192]:
+                return
+            text = data.decode("utf-8", errors="replace")
+            grams = trigrams(text.lower())
+            self.files[path] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "text": text, "trigrams": grams}
+            for gram in grams:
+                self.postings[gram].add(path)
+
+    def forget(self, path):
+        entry = self.files.pop(path, None)
+        if entry is not None:
+            for gram in entry["trigrams"]:
+                paths = self.postings[gram]
+                paths.discard(path)
+                if not paths:
+                    del self.postings[gram]
+
+    def scan(self):
+        # Re-indexes files whose mtime or size changed since they were read
+        with self.lock:
+            seen = set()
+            for root, dirs, files in os.walk(self.root):
+                dirs[:] = [name for name in dirs if name not in SEARCH_EXCLUDED_DIRS]
+                for name in files:
+                    path = os.path.join(root, name)
+                    seen.add(path)
+                    entry = self.files.get(path)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if entry is None or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                        self.index_file(path)
+            for path in set(self.files) - seen:
+                self.forget(path)
+            self.last_scan = time.monotonic()
+
+    def update(self, path):
+        # Hook for tools that just wrote path, a file or a whole tree
+        path = os.path.abspath(path)
+        with self.lock:
+            if os.path.isdir(path):
+                # Let the next search pick the tree up
+                self.last_scan = 0
+            elif not set(os.path.relpath(path, self.root).split(os.sep)) & SEARCH_EXCLUDED_DIRS:
+                self.index_file(path)
+
+    def search(self, query, regex=False, case_sensitive=False, glob=None, max_results=SEARCH_MAX_RESULTS):
+        if time.monotonic() - self.last_scan > SEARCH_RESCAN_SECONDS:
+            self.scan()
+        flags = 0 if case_sensitive else re.IGNORECASE
+        pattern = re.compile(query if regex else re.escape(query), flags)
+        literals = required_literals(query, flags) if regex else [query]
+        with self.lock:
+            # Only files holding every trigram of the literals can match
+            candidates = None
+            for literal in literals:
+                for gram in trigrams(literal.lower()):
+                    # get() so lookups do not grow the defaultdict
+                    paths = self.postings.get(gram, set())
+                    candidates = set(paths) if candidates is None else candidates & paths
+            if candidates is None:
+                candidates = set(self.files)
+            hits, truncated = [], False
+            for path in sorted(candidates):
+                relative = os.path.relpath(path, self.root)
+                if glob and not fnmatch.fnmatch(relative, glob) and not fnmatch.fnmatch(os.path.basename(path), glob):
+                    continue
+                for number, line in enumerate(self.files[path]["text"].splitlines(), 1):
+                    if pattern.search(line):
+                        if len(hits) == max_results:
+                            truncated = True
+                            break
+                        hits.append(f"{relative}:{number}: {line.strip()[:SEARCH_LINE_CHARS]}")
+                if truncated:
+                    break
+            return hits, truncated, len(candidates), len(self.files)
+
+
+class ProjectIndexes:
+    def __init__(self):
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get(self, root):
+        root = os.path.abspath(root)
+        with self.lock:
+            if root not in self.indexes:
+                self.indexes[root] = ProjectIndex(root)
+            return self.indexes[root]
+
+    def notify(self, path):
+        # Called after tools write files so searches see them right away
+        with self.lock:
+            indexes = [index for index in self.indexes.values() if index.contains(path)]
+        for index in indexes:
+            index.update(path)
+
+
+project_indexes = ProjectIndexes()
+
+
+@tool(
+    description="""Search the files of a project for a string or regular expression and get back
+    file:line matches. Use it to find where something is defined or used instead of reading files
+    through scripts. node_modules, build output and virtual environments are not searched.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "directory": {
+                "type": "string",
+                "description": """The project directory to search, for example auto/MyProject.""",
+            },
+            "query": {
+                "type": "string",
+                "description": """The text to look for.""",
+            },
+            "regex": {
+                "type": "boolean",
+                "description": """Treat the query as a Python regular expression. Defaults to false.""",
+            },
+            "case_sensitive": {
+                "type": "boolean",
+                "description": """Match case exactly. Defaults to false.""",
+            },
+            "glob": {
+                "type": "string",
+                "description": """Only search files matching this pattern, like *.js or src/*.""",
+            },
+            "max_results": {
+                "type": "integer",
+                "description": """The most matching lines to return. Defaults to 50.""",
+            },
+        },
+        "required": ["directory", "query"],
+    },
+)
+def search_project(args):
+    # Decode arguments
+    directory = args.get("directory")
+    query = args.get("query", "")
+    regex = bool(args.get("regex", False))
+    case_sensitive = bool(args.get("case_sensitive", False))
+    glob = args.get("glob")
+    max_results = int(args.get("max_results", SEARCH_MAX_RESULTS))
+    if not os.path.isdir(directory or ""):
+        return json.dumps({"error": f"{directory} is not a directory"})
+    if not query:
+        return json.dumps({"error": "The query is empty"})
+    start = time.perf_counter()
+    try:
+        hits, truncated, searched, total = project_indexes.get(directory).search(
+            query, regex, case_sensitive, glob, max_results
+        )
+    except re.error as e:
+        return json.dumps({"error": f"Invalid regular expression: {e}"})
+    return json.dumps(
+        {
+            "matches": hits,
+            "truncated": truncated,
+            "files_searched": searched,
+            "files_indexed": total,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+    )
+
+
+################### FILE EDITS ###################
+# A hunk whose context lines no longer match exactly is still applied where
+# the file is at least this similar to them. The lines it removes must be
+# there as written, give or take whitespace.
+FUZZY_MATCH_RATIO = float(os.environ.get("EDIT_FUZZY_MATCH_RATIO", "0.85"))
+# Fuzzy matches this close to the best one make a search/replace hunk
+# ambiguous. Diff hunks go to the candidate nearest their line number.
+FUZZY_AMBIGUITY_MARGIN = 0.05
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class AmbiguousHunk(Exception):
+    def __init__(self, lines):
+        super().__init__(f"Matches equally well at lines {', '.join(map(str, lines))}")
+        self.lines = lines
+
+
+def parse_unified_diff(diff):
+    # Returns hunks as (old lines, new lines, 0-based line hint, context)
+    # where context maps each context line's index in old to its index in new
+    hunks = []
+    hunk = None
+    for line in diff.splitlines():
+        header = HUNK_HEADER.match(line)
+        if header:
+            hunk = ([], [], max(int(header.group(1)) - 1, 0), {})
+            hunks.append(hunk)
+        elif hunk is None:
+            # File headers and anything else before the first hunk
+            continue
+        elif line.startswith("\\"):
+            # "\ No newline at end of file"
+            continue
+        elif line.startswith("-"):
+            hunk[0].append(line[1:])
+        elif line.startswith("+"):
+            hunk[1].append(line[1:])
+        else:
+            # Context lines; models often drop the leading space of blank ones
+            hunk[3][len(hunk[0])] = len(hunk[1])
+            hunk[0].append(line[1:] if line.startswith(" ") else line)
+            hunk[1].append(line[1:] if line.startswith(" ") else line)
+    if not hunks:
+        raise ValueError("The diff has no @@ hunk headers")
+    return hunks
+
+
+def search_replace_hunks(edits):
+    hunks = []
+    for index, edit in enumerate(edits):
+        search = edit.get("search", "")
+        if not search:
+            raise ValueError(f"Edit {index + 1} has no search text")
+        # Everything searched for is replaced, so none of it is context
+        hunks.append((search.splitlines(), edit.get("replace", "").splitlines(), None, {}))
+    return hunks
+
+
+def squash_whitespace(line):
+    return " ".join(line.split())
+
+
+def find_hunk(lines, old, hint, context=()):
+    # Returns (start, how it matched, similarity) or None
+    size = len(old)
+    starts = range(len(lines) - size + 1)
+    nearest = lambda start: abs(start - hint) if hint is not None else start
+    for how, normalize in (("exact", lambda line: line), ("whitespace", squash_whitespace)):
+        wanted = [normalize(line) for line in old]
+        found = [start for start in starts if [normalize(line) for line in lines[start : start + size]] == wanted]
+        if len(found) > 1 and hint is None:
+            raise AmbiguousHunk([start + 1 for start in found])
+        if found:
+            return min(found, key=nearest), how, 1.0
+    # Fuzzy: the block of the same length with its removed lines in place
+    # and the most similar context
+    if not context:
+        return None
+    required = [(index, squash_whitespace(line)) for index, line in enumerate(old) if index not in context]
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2("\n".join(old[index].strip() for index in context))
+    candidates = []
+    for start in starts:
+        if any(squash_whitespace(lines[start + index]) != line for index, line in required):
+            continue
+        matcher.set_seq1("\n".join(lines[start + index].strip() for index in context))
+        if matcher.real_quick_ratio() < FUZZY_MATCH_RATIO or matcher.quick_ratio() < FUZZY_MATCH_RATIO:
+            continue
+        ratio = matcher.ratio()
+        if ratio >= FUZZY_MATCH_RATIO:
+            candidates.append((ratio, start))
+    if not candidates:
+        return None
+    best = max(ratio for ratio, _ in candidates)
+    close = [start for ratio, start in candidates if best - ratio < FUZZY_AMBIGUITY_MARGIN]
+    if len(close) > 1 and hint is None:
+        # Similar looking blocks, like sibling functions; guessing could
+        # silently edit the wrong one
+        raise AmbiguousHunk([start + 1 for start in close])
+    start = min(close, key=nearest)
+    return start, "fuzzy", dict((start, ratio) for ratio, start in candidates)[start]
+
+
+def closest_block(lines, old):
+    # Where a hunk that did not apply probably belongs, for the conflict report
+    if not lines or not old:
+        return None
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(old[0].strip())
+    ratios = []
+    for start, line in enumerate(lines):
+        matcher.set_seq1(line.strip())
+        ratios.append((matcher.ratio(), start))
+    _, start = max(ratios)
+    return start
+
+
+def apply_hunks(text, hunks):
+    lines = text.splitlines()
+    # Edited files keep their line endings
+    newline = "\r\n" if text.partition("\n")[0].endswith("\r") else "\n"
+    offset = 0
+    applied, conflicts = [], []
+    for index, (old, new, hint, context) in enumerate(hunks):
+        hint = hint + offset if hint is not None else None
+        if not old:
+            # Pure insertion at the line the diff names
+            start = min(hint if hint is not None else len(lines), len(lines))
+            match = (start, "insert", 1.0)
+        else:
+            try:
+                match = find_hunk(lines, old, hint, context)
+            except AmbiguousHunk as e:
+                conflicts.append({"hunk": index + 1, "expected": "\n".join(old), "reason": str(e)})
+                continue
+        if match is None:
+            start = closest_block(lines, old)
+            conflict = {"hunk": index + 1, "expected": "\n".join(old), "reason": "No matching lines"}
+            if start is not None:
+                conflict["closest_lines"] = f"{start + 1}-{min(start + len(old), len(lines))}"
+                conflict["found"] = "\n".join(lines[start : start + len(old)])
+            conflicts.append(conflict)
+            continue
+        start, how, ratio = match
+        # Context lines stay as they are in the file, not as the diff quoted them
+        new = list(new)
+        for old_index, new_index in context.items():
+            new[new_index] = lines[start + old_index]
+        lines[start : start + len(old)] = new
+        offset += len(new) - len(old)
+        applied.append({"hunk": index + 1, "line": start + 1, "match": how, "similarity": round(ratio, 2)})
+    new_text = newline.join(lines)
+    if lines and (text.endswith("\n") or not text):
+        new_text += newline
+    return new_text, applied, conflicts
+
+
+################### OUTPUT CONDENSING ###################
+# Big tool results are condensed before they reach the model. The full text
+# is kept on disk under a handle that expand_output can read back.
+TOOL_OUTPUT_DIR = os.path.join(CACHE_DIR, "tool_outputs")
+# Stored outputs older than this are deleted
+TOOL_OUTPUT_MAX_AGE = 7 * 24 * 60 * 60
+# Token budget per text field of a result, and the lines always kept from
+# its start and end
+DEFAULT_OUTPUT_POLICY = {"max_tokens": 2000, "head_lines": 10, "tail_lines": 40}
+TOOL_OUTPUT_POLICIES = {
+    # pip logs: what failed and the summary at the end
+    "create_virtual_env": {"max_tokens": 800, "head_lines": 3, "tail_lines": 20},
+    "initialize_react_app": {"max_tokens": 800, "head_lines": 3, "tail_lines": 20},
+    "deploy_app_to_netlify": {"max_tokens": 1000, "head_lines": 5, "tail_lines": 30},
+    "redeploy_app_to_netlify": {"max_tokens": 1000, "head_lines": 5, "tail_lines": 30},
+    "run_python_script": {"max_tokens": 3000, "head_lines": 30, "tail_lines": 60},
+    "search_website": {"max_tokens": 6000, "head_lines": 0, "tail_lines": 0},
+    "search_google": {"max_tokens": 3000, "head_lines": 0, "tail_lines": 0},
+    # Already paged
+    "expand_output": None,
 }
+# Lines worth keeping wherever they are
+IMPORTANT_LINE = re.compile(
+    r"error|exception|traceback|failed|failure|fatal|warning|denied|not found|ERR!|^\s*File \"", re.IGNORECASE
+)
+# Lines that only differ in their numbers, like progress bars, count as repeats
+DIGITS = re.compile(r"\d+")
+EXPAND_OUTPUT_LINES = 200
+
+
+def collapse_repeats(lines):
+    collapsed = []
+    previous_key, repeats = None, 0
+    for line in lines:
+        key = DIGITS.sub("#", line.strip())
+        if key == previous_key:
+            repeats += 1
+            collapsed[-1] = line
+            continue
+        if repeats:
+            collapsed[-1] += f"  [repeated {repeats + 1} times]"
+        collapsed.append(line)
+        previous_key, repeats = key, 0
+    if repeats:
+        collapsed[-1] += f"  [repeated {repeats + 1} times]"
+    return collapsed
+
+
+def store_tool_output(text):
+    handle = hashlib.sha1(text.encode()).hexdigest()[:12]
+    os.makedirs(TOOL_OUTPUT_DIR, exist_ok=True)
+    with open(os.path.join(TOOL_OUTPUT_DIR, f"{handle}.txt"), "w") as f:
+        f.write(text)
+    cutoff = time.time() - TOOL_OUTPUT_MAX_AGE
+    for name in os.listdir(TOOL_OUTPUT_DIR):
+        path = os.path.join(TOOL_OUTPUT_DIR, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+    return handle
+
+
+def condense_text(text, policy):
+    if count_tokens(text) <= policy["max_tokens"]:
+        return text
+    handle = store_tool_output(text)
+    lines = collapse_repeats(text.splitlines())
+    # Always keep the head and tail, then errors nearest the end
+    keep = set(range(min(policy["head_lines"], len(lines))))
+    keep.update(range(max(len(lines) - policy["tail_lines"], 0), len(lines)))
+    budget = policy["max_tokens"] - sum(count_tokens(lines[i]) for i in keep)
+    for index in reversed(range(len(lines))):
+        if index not in keep and IMPORTANT_LINE.search(lines[index]):
+            cost = count_tokens(lines[index])
+            if cost > budget:
+                break
+            keep.add(index)
+            budget -= cost
+    note = f"[Condensed. Call expand_output with handle {handle} for the full text.]"
+    # What is left once the note and an omission marker are paid for
+    budget = max(policy["max_tokens"] - count_tokens(note) - 20, 0)
+    if not keep:
+        # Nothing to keep line by line, such as a page's text on a single
+        # line, so keep as much of its start as fits
+        prefix, _ = truncate_text(text, max_tokens=budget)
+        return f"{prefix}\n... [{len(text) - len(prefix)} characters omitted] ...\n{note}"
+    condensed = []
+    previous = -1
+    for index in sorted(keep):
+        if index > previous + 1:
+            condensed.append(f"... [{index - previous - 1} lines omitted] ...")
+        condensed.append(lines[index])
+        previous = index
+    if previous < len(lines) - 1:
+        condensed.append(f"... [{len(lines) - previous - 1} lines omitted] ...")
+    text, _ = truncate_text("\n".join(condensed), max_tokens=budget)
+    return f"{text}\n{note}"
+
+
+def condense_tool_output(function_name, function_response):
+    # Condenses every long text field of a JSON tool result
+    policy = TOOL_OUTPUT_POLICIES.get(function_name, DEFAULT_OUTPUT_POLICY)
+    if policy is None or not isinstance(function_response, str):
+        return function_response
+    try:
+        result = json.loads(function_response)
+    except ValueError:
+        return condense_text(function_response, policy)
+    if not isinstance(result, dict):
+        return function_response
+    for key, value in result.items():
+        if isinstance(value, str):
+            result[key] = condense_text(value, policy)
+    return json.dumps(result)
+
+
+@tool(
+    description="""Read the full text of a tool output that was condensed. Condensed outputs end with
+    the handle to pass here.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "handle": {
+                "type": "string",
+                "description": """The handle given in the condensed output.""",
+            },
+            "start_line": {
+                "type": "integer",
+                "description": """The line number to start from, as shown before each returned line.
+                Lines are numbered from 1. Defaults to 1.""",
+            },
+            "line_count": {
+                "type": "integer",
+                "description": """The number of lines to return, at most 200.""",
+            },
+            "pattern": {
+                "type": "string",
+                "description": """Only return lines matching this regular expression.""",
+            },
+        },
+        "required": ["handle"],
+    },
+)
+def expand_output(args):
+    # Decode arguments
+    handle = args.get("handle")
+    start_line = max(int(args.get("start_line", 1)), 1)
+    line_count = min(int(args.get("line_count", EXPAND_OUTPUT_LINES)), EXPAND_OUTPUT_LINES)
+    pattern = args.get("pattern")
+    if not re.fullmatch(r"[0-9a-f]{12}", handle or ""):
+        return json.dumps({"error": f"{handle} is not an output handle"})
+    try:
+        pattern = re.compile(pattern) if pattern else None
+    except re.error as e:
+        return json.dumps({"error": f"Invalid regular expression: {e}"})
+    try:
+        with open(os.path.join(TOOL_OUTPUT_DIR, f"{handle}.txt")) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return json.dumps({"error": f"No stored output with handle {handle}"})
+    # Line numbers count from 1 in both start_line and the returned lines,
+    # so a number the model has seen can be passed back as it is
+    numbered = list(enumerate(lines, 1))
+    if pattern:
+        numbered = [(number, line) for number, line in numbered if pattern.search(line)]
+    following = [(number, line) for number, line in numbered if number >= start_line]
+    selected = following[:line_count]
+    return json.dumps(
+        {
+            "lines": "\n".join(f"{number}: {line}" for number, line in selected),
+            "total_lines": len(lines),
+            "matching_lines": len(numbered),
+            "next_start_line": following[line_count][0] if len(following) > line_count else None,
+        }
+    )
@@ -0,0 +1,277 @@
+"""Server mode for the assistant.
+
+    python server.py [--host HOST] [--port PORT] [--workers N]
+
+Every TCP connection is a session with its own thread. A client sends one
+JSON object per line, {"message": "..."}, optionally with "thread_id" on the
+first one to continue an existing thread, and gets the run's events back as
+JSON lines ending with {"event": "run.done"}. Sessions run concurrently on
+one event loop; their tool calls share a bounded worker pool.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import AsyncOpenAI, AsyncAssistantEventHandler
+from typing_extensions import override
+
+from assistant import MODEL, MY_ASSISTANTS, MAX_TOOL_WORKERS, call_tool, get_assistant, load_state
+from assistant import group_tool_calls, parse_tool_calls
+
+# Tool calls a single session may have waiting for a worker. Further calls
+# from it wait, which pauses its run, until its earlier ones are picked up.
+MAX_QUEUED_PER_SESSION = 8
+# Tool calls waiting across all sessions
+MAX_QUEUED_TOOL_CALLS = 64
+# Longest request line a client may send
+MAX_LINE_BYTES = 1024 * 1024
+
+
+class ToolScheduler:
+    # Runs the tool calls of every session on one bounded pool. Sessions
+    # take turns one call at a time, so a session with a large batch cannot
+    # starve the others, and submit waits while the queues are full.
+    def __init__(self, workers=MAX_TOOL_WORKERS, max_queued_per_session=MAX_QUEUED_PER_SESSION,
+                 max_queued=MAX_QUEUED_TOOL_CALLS):
+        self.workers = workers
+        self.max_queued_per_session = max_queued_per_session
+        self.max_queued = max_queued
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tool")
+        # Queued calls per session, and the sessions with queued calls in
+        # the order they get their next turn
+        self.queues = {}
+        self.ready = deque()
+        self.queued = 0
+        self.condition = asyncio.Condition()
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    def has_room(self, session):
+        return self.queued < self.max_queued and len(self.queues.get(session, ())) < self.max_queued_per_session
+
+    async def submit(self, session, function_name, function_arguments):
+        future = asyncio.get_running_loop().create_future()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.has_room(session))
+            queue = self.queues.setdefault(session, deque())
+            if not queue:
+                self.ready.append(session)
+            queue.append((function_name, function_arguments, future))
+            self.queued += 1
+            self.condition.notify_all()
+        return await future
+
+    async def work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.ready)
+                session = self.ready.popleft()
+                queue = self.queues[session]
+                function_name, function_arguments, future = queue.popleft()
+                if queue:
+                    self.ready.append(session)
+                else:
+                    del self.queues[session]
+                self.queued -= 1
+                self.condition.notify_all()
+            if future.cancelled():
+                # The session went away while the call was queued
+                continue
+            try:
+                result = await loop.run_in_executor(self.executor, call_tool, function_name, function_arguments)
+            except Exception as e:
+                result = json.dumps({"error": f"{function_name} failed: {e}"})
+            if not future.cancelled():
+                future.set_result(result)
+
+
+class SessionEventHandler(AsyncAssistantEventHandler):
+    def __init__(self, session) -> None:
+        super().__init__()
+        self.session = session
+        # The run as it stopped for tool outputs, if it did
+        self.required_action_run = None
+
+    @override
+    async def on_event(self, event) -> None:
+        if event.event == "thread.run.requires_action":
+            self.required_action_run = event.data
+
+    @override
+    async def on_text_delta(self, delta, snapshot) -> None:
+        await self.session.send({"event": "text.delta", "value": delta.value})
+
+    @override
+    async def on_tool_call_created(self, tool_call) -> None:
+        event = {"event": "tool_call.created", "type": tool_call.type}
+        if tool_call.type == "function":
+            event["name"] = tool_call.function.name
+        await self.session.send(event)
+
+    @override
+    async def on_tool_call_delta(self, delta, snapshot) -> None:
+        if delta.type == "code_interpreter":
+            if delta.code_interpreter.input:
+                await self.session.send({"event": "code.delta", "value": delta.code_interpreter.input})
+            for output in delta.code_interpreter.outputs or []:
+                if output.type == "logs":
+                    await self.session.send({"event": "code.output", "value": output.logs})
+
+
+class Session:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.thread_id = None
+
+    async def send(self, event):
+        # drain() holds the run back while a slow client catches up
+        self.writer.write(json.dumps(event).encode() + b"\n")
+        await self.writer.drain()
+
+    async def run_tool_group(self, calls):
+        # Calls in a group depend on each other and run one after another
+        outputs = []
+        for function_name, function_arguments in calls:
+            if function_arguments is None:
+                outputs.append(json.dumps({"error": f"The arguments for {function_name} are not valid JSON"}))
+            else:
+                outputs.append(await self.server.scheduler.submit(self, function_name, function_arguments))
+        return outputs
+
+    async def run_tool_calls(self, tool_calls):
+        # Independent groups run concurrently; results come back in the
+        # order the model asked for them
+        calls = parse_tool_calls(tool_calls)
+        groups = group_tool_calls([(name, arguments or {}) for _, name, arguments in calls])
+        results = await asyncio.gather(
+            *(self.run_tool_group([calls[index][1:] for index in indexes]) for indexes in groups)
+        )
+        outputs = {}
+        for indexes, group_outputs in zip(groups, results):
+            outputs.update(zip(indexes, group_outputs))
+        return [
+            {"tool_call_id": tool_call_id, "output": json.dumps(outputs[index])}
+            for index, (tool_call_id, _, _) in enumerate(calls)
+        ]
+
+    async def run_until_done(self):
+        # The asyncio twin of assistant.run_until_done
+        runs = self.server.client.beta.threads.runs
+        handler = SessionEventHandler(self)
+        manager = runs.create_and_stream(
+            thread_id=self.thread_id,
+            assistant_id=self.server.assistant_id,
+            event_handler=handler,
+        )
+        while True:
+            async with manager as stream:
+                await stream.until_done()
+            run = handler.required_action_run
+            if run is None or run.required_action.type != "submit_tool_outputs":
+                return handler.current_run
+            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+            start = time.perf_counter()
+            tool_outputs = await self.run_tool_calls(tool_calls)
+            await self.send(
+                {
+                    "event": "tool_calls.done",
+                    "count": len(tool_outputs),
+                    "elapsed_seconds": round(time.perf_counter() - start, 3),
+                }
+            )
+            handler = SessionEventHandler(self)
+            manager = runs.submit_tool_outputs_stream(
+                thread_id=self.thread_id,
+                run_id=run.id,
+                tool_outputs=tool_outputs,
+                event_handler=handler,
+            )
+
+    async def serve(self):
+        client = self.server.client
+        while line := await self.reader.readline():
+            try:
+                request = json.loads(line)
+                message = request["message"]
+            except (ValueError, KeyError, TypeError):
+                await self.send({"event": "error", "message": 'Expected a JSON line like {"message": "..."}'})
+                continue
+            if self.thread_id is None:
+                if request.get("thread_id"):
+                    self.thread_id = (await client.beta.threads.retrieve(request["thread_id"])).id
+                else:
+                    self.thread_id = (await client.beta.threads.create()).id
+                await self.send({"event": "session", "thread_id": self.thread_id})
+            await client.beta.threads.messages.create(self.thread_id, role="user", content=message)
+            run = await self.run_until_done()
+            await self.send({"event": "run.done", "status": run.status if run is not None else None})
+
+
+class Server:
+    def __init__(self, assistant_id, workers=MAX_TOOL_WORKERS):
+        self.assistant_id = assistant_id
+        self.client = AsyncOpenAI()
+        self.scheduler = ToolScheduler(workers)
+        self.sessions = set()
+
+    async def handle(self, reader, writer):
+        session = Session(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.serve()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            # One failing session must not take the others down
+            try:
+                await session.send({"event": "error", "message": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    async def serve(self, host, port):
+        self.scheduler.start()
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE_BYTES)
+        print(f"Serving on {host}:{port}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.scheduler.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the assistant to many clients at once.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--workers", type=int, default=MAX_TOOL_WORKERS, help="Tool calls run at once")
+    parser.add_argument("--assistant", choices=list(MY_ASSISTANTS), default="planner")
+    parser.add_argument("--model", default=MODEL)
+    args = parser.parse_args()
+
+    assistant_id = get_assistant(load_state(), args.assistant, args.model)
+    try:
+        asyncio.run(Server(assistant_id, args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import os
+import json
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from openai import OpenAI
+
+# assistant.py creates its client on import
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import assistant  # noqa: E402
+
+
+class AssistantsApiHandler(BaseHTTPRequestHandler):
+    # The assistants and threads endpoints, kept in memory
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def not_found(self, kind, object_id):
+        message = f"No {kind} found with id '{object_id}'."
+        self.reply(404, {"error": {"message": message, "type": "invalid_request_error"}})
+
+    def handle_request(self, method):
+        api = self.server.api
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        parts = self.path.split("?")[0].strip("/").split("/")[1:]
+        api.requests.append((method, "/".join(parts)))
+        kind, object_id = parts[0], parts[1] if len(parts) > 1 else None
+        objects = api.assistants if kind == "assistants" else api.threads
+        if object_id is None and method == "POST":
+            object_id = f"{kind[:-1]}_{next(api.ids)}"
+            objects[object_id] = {"id": object_id, "created_at": 0, "metadata": {}}
+            if kind == "assistants":
+                objects[object_id].update(
+                    {"object": "assistant", "name": None, "description": None, "file_ids": [], "tools": []}
+                )
+            else:
+                objects[object_id]["object"] = "thread"
+        elif object_id not in objects:
+            return self.not_found(kind[:-1], object_id)
+        objects[object_id].update(body)
+        self.reply(200, objects[object_id])
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+
+class AssistantsApi:
+    def __init__(self):
+        self.assistants = {}
+        self.threads = {}
+        self.requests = []
+        self.ids = itertools.count(1)
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), AssistantsApiHandler)
+    httpd.api = AssistantsApi()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    monkeypatch.setattr(assistant, "client", OpenAI(base_url=base_url, api_key="test", max_retries=0))
+    monkeypatch.setattr(assistant, "STATE_FILE", str(tmp_path / "state.json"))
+    yield httpd.api
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def launch(model=assistant.MODEL):
+    # What main() does on start
+    state = assistant.load_state()
+    return assistant.get_assistant(state, "planner", model)
+
+
+def test_unchanged_assistant_is_reused(api):
+    first = launch()
+    api.requests.clear()
+    assert launch() == first
+    assert api.requests == [("GET", f"assistants/{first}")]
+    assert len(api.assistants) == 1
+
+
+def test_changed_assistant_is_updated_in_place(api):
+    first = launch()
+    api.requests.clear()
+    assert launch(model="gpt-4o") == first
+    assert api.requests == [("POST", f"assistants/{first}")]
+    assert api.assistants[first]["model"] == "gpt-4o"
+
+
+def test_deleted_assistant_is_created_again(api):
+    first = launch()
+    del api.assistants[first]
+    second = launch()
+    assert second != first
+    assert second in api.assistants
+    # and saved, so the next launch reuses it
+    assert launch() == second
+    assert len(api.assistants) == 1
+
+
+def test_deleted_and_changed_assistant_is_created_again(api):
+    first = launch()
+    del api.assistants[first]
+    second = launch(model="gpt-4o")
+    assert second != first
+    assert api.assistants[second]["model"] == "gpt-4o"
+
+
+def test_deleted_thread_is_replaced_on_resume(api):
+    state = assistant.load_state()
+    first = assistant.get_thread(state, "planner", resume=False)
+    assert assistant.get_thread(assistant.load_state(), "planner", resume=True) == first
+    del api.threads[first]
+    second = assistant.get_thread(assistant.load_state(), "planner", resume=True)
+    assert second != first
+    assert second in api.threads
@@ -0,0 +1,97 @@
+import time
+import threading
+
+import pytest
+
+import functions
+
+
+class StubDriverError(Exception):
+    pass
+
+
+class StubDriver:
+    # Stands in for a selenium driver
+    def __init__(self):
+        self.quit_called = False
+        self.broken = False
+
+    @property
+    def current_url(self):
+        if self.broken:
+            raise StubDriverError("gone")
+        return "about:blank"
+
+    def quit(self):
+        self.quit_called = True
+
+
+def make_pool(size=1, idle_timeout=100):
+    drivers = []
+
+    def factory():
+        drivers.append(StubDriver())
+        return drivers[-1]
+
+    pool = functions.BrowserPool(factory=factory, size=size, idle_timeout=idle_timeout, broken_error=StubDriverError)
+    return pool, drivers
+
+
+def test_browsers_are_reused():
+    pool, drivers = make_pool()
+    with pool.browser() as first:
+        pass
+    with pool.browser() as second:
+        pass
+    assert first is second
+    assert len(drivers) == 1
+    pool.close()
+
+
+def test_blocked_checkout_wakes_up_with_the_reaper_running():
+    pool, drivers = make_pool(size=1)
+    # A first checkin starts the reaper
+    pool.checkin(pool.checkout())
+    browser = pool.checkout()
+    checked_out = threading.Event()
+
+    def waiter():
+        pool.checkout()
+        checked_out.set()
+
+    thread = threading.Thread(target=waiter, daemon=True)
+    thread.start()
+    time.sleep(0.1)
+    pool.checkin(browser)
+    assert checked_out.wait(2)
+    assert len(drivers) == 1
+    pool.close()
+
+
+def test_unhealthy_browsers_are_replaced():
+    pool, drivers = make_pool()
+    with pool.browser() as browser:
+        pass
+    browser.broken = True
+    with pool.browser() as replacement:
+        pass
+    assert replacement is not browser
+    assert browser.quit_called
+    pool.close()
+
+
+def test_idle_browsers_are_evicted():
+    pool, drivers = make_pool(idle_timeout=0)
+    with pool.browser():
+        pass
+    assert pool.evict_idle() == 1
+    assert drivers[0].quit_called
+    assert pool.live == 0
+    pool.close()
+
+
+def test_checkout_after_close_fails():
+    pool, _ = make_pool()
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.checkout()
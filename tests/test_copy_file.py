@@ -0,0 +1,24 @@
+import json
+
+import functions
+
+
+def copy(file_name, directory):
+    return json.loads(functions.copy_file({"file_name": str(file_name), "directory": str(directory)}))
+
+
+def test_tree_is_copied(tmp_path):
+    (tmp_path / "project" / "src").mkdir(parents=True)
+    (tmp_path / "project" / "src" / "main.py").write_text("print('hi')\n")
+    result = copy(tmp_path / "project", tmp_path / "backup")
+    assert result["files"] == 1
+    assert (tmp_path / "backup" / "project" / "src" / "main.py").read_text() == "print('hi')\n"
+
+
+def test_tree_is_not_copied_into_itself(tmp_path):
+    (tmp_path / "project" / "src").mkdir(parents=True)
+    (tmp_path / "project" / "main.py").write_text("print('hi')\n")
+    (tmp_path / "alias").symlink_to(tmp_path / "project")
+    assert "error" in copy(tmp_path / "project", tmp_path / "project" / "src")
+    assert "error" in copy(tmp_path / "project", tmp_path / "alias" / "src" / "copies")
+    assert sorted(path.name for path in (tmp_path / "project").rglob("*")) == ["main.py", "src"]
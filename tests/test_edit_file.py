@@ -0,0 +1,48 @@
+import json
+
+import functions
+
+CONFIG = "import os\n\nTIMEOUT_SECONDS = 100\nRETRIES = 3\n"
+
+
+def edit(file_name, **args):
+    return json.loads(functions.edit_file({"file_name": str(file_name), **args}))
+
+
+def test_search_text_must_match(tmp_path):
+    config = tmp_path / "config.py"
+    config.write_text(CONFIG)
+    result = edit(config, edits=[{"search": "TIMEOUT_SECONDS = 250", "replace": "TIMEOUT_SECONDS = 300"}])
+    assert result["conflicts"][0]["found"] == "TIMEOUT_SECONDS = 100"
+    assert config.read_text() == CONFIG
+
+
+def test_removed_lines_must_match(tmp_path):
+    config = tmp_path / "config.py"
+    config.write_text(CONFIG)
+    diff = "@@ -1,4 +1,4 @@\n import os\n \n-TIMEOUT_SECONDS = 250\n+TIMEOUT_SECONDS = 300\n RETRIES = 3\n"
+    assert "conflicts" in edit(config, diff=diff)
+    assert config.read_text() == CONFIG
+
+
+def test_drifted_context_keeps_the_file_lines(tmp_path):
+    config = tmp_path / "config.py"
+    config.write_text(CONFIG)
+    diff = "@@ -1,4 +1,4 @@\n import os\n \n-TIMEOUT_SECONDS = 100\n+TIMEOUT_SECONDS = 300\n RETRIES = 4\n"
+    result = edit(config, diff=diff)
+    assert result["hunks"][0]["match"] == "fuzzy"
+    assert config.read_text() == "import os\n\nTIMEOUT_SECONDS = 300\nRETRIES = 3\n"
+
+
+def test_crlf_line_endings_are_kept(tmp_path):
+    notes = tmp_path / "notes.txt"
+    notes.write_bytes(b"one\r\ntwo\r\nthree\r\n")
+    edit(notes, edits=[{"search": "two", "replace": "2\nzwei"}])
+    assert notes.read_bytes() == b"one\r\n2\r\nzwei\r\nthree\r\n"
+
+
+def test_no_changes_is_an_error(tmp_path):
+    config = tmp_path / "config.py"
+    config.write_text(CONFIG)
+    assert "error" in edit(config)
+    assert "error" in edit(config, edits=[])
@@ -0,0 +1,29 @@
+import pytest
+
+import functions
+
+BODY = "<p>" + "Body text that a reader came for. " * 10 + "</p>"
+
+
+@pytest.mark.parametrize(
+    "chrome",
+    [
+        "<input type=search role=search>",
+        "<img role=banner src=logo.png>",
+        "<input type=search role=search/>",
+        "<nav><a href=/home>Home</a></nav>",
+    ],
+)
+def test_stream_backend_keeps_text_after_page_chrome(chrome):
+    html = f"<html><body>{chrome}{BODY}</body></html>"
+    text, _ = functions.extract_with_stream(html, "", functions.EXTRACT_MAX_CHARS, True)
+    assert "Body text that a reader came for." in text
+    assert "Home" not in text
+
+
+def test_backends_agree_on_void_elements():
+    pytest.importorskip("lxml")
+    html = f"<html><body><input type=search role=search>{BODY}</body></html>"
+    stream_text, _ = functions.extract_with_stream(html, "", functions.EXTRACT_MAX_CHARS, True)
+    lxml_text, _ = functions.extract_with_lxml(html, "", functions.EXTRACT_MAX_CHARS, True)
+    assert stream_text == lxml_text
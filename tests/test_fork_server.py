@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+
+import pytest
+
+import functions
+
+
+class UnstartedServer(functions.ForkServer):
+    # A fork server at a socket of the test's choosing, without a process
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+
+# A stand-in for numpy whose global random state is seeded at import
+FAKE_NUMPY = {
+    "__init__.py": "from . import random\n",
+    "random.py": (
+        "import os\n"
+        "state = os.urandom(8).hex()\n"
+        "def seed():\n"
+        "    global state\n"
+        "    state = os.urandom(8).hex()\n"
+    ),
+}
+
+
+def start_fork_server(modules):
+    server = functions.ForkServer(sys.executable, modules=modules)
+    # A server killed by an earlier run leaves its socket file behind, so
+    # wait until this one accepts connections
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(server.socket_path)
+                break
+            except OSError:
+                time.sleep(0.05)
+    return server
+
+
+@pytest.fixture
+def fork_server():
+    server = start_fork_server([])
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def numpy_fork_server(tmp_path, monkeypatch):
+    package = tmp_path / "lib" / "numpy"
+    package.mkdir(parents=True)
+    for name, content in FAKE_NUMPY.items():
+        (package / name).write_text(content)
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path / "lib"))
+    server = start_fork_server(["numpy"])
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("reply", [b"", b"not json\n", b"[]\n"])
+def test_server_gone_before_start_falls_back_to_spawn(tmp_path, reply):
+    socket_path = str(tmp_path / "server.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+
+    def answer():
+        connection, _ = listener.accept()
+        _, fds, _, _ = socket.recv_fds(connection, 65536, 2)
+        for fd in fds:
+            os.close(fd)
+        connection.sendall(reply)
+        connection.close()
+
+    thread = threading.Thread(target=answer)
+    thread.start()
+    try:
+        assert UnstartedServer(socket_path).run(["script.py"], timeout=5) is None
+    finally:
+        thread.join()
+        listener.close()
+
+
+def test_server_killed_mid_run_reports_an_error(fork_server, tmp_path, monkeypatch):
+    script = tmp_path / "slow.py"
+    script.write_text("import time\nprint('started', flush=True)\ntime.sleep(1)\nprint('finished')\n")
+    monkeypatch.chdir(tmp_path)
+    threading.Timer(0.5, os.kill, (fork_server.process.pid, signal.SIGKILL)).start()
+    result = fork_server.run([str(script)], timeout=10)
+    assert result["exit_code"] is None
+    assert "started" in result["output"]
+    assert "fork server stopped" in result["error"]
+    # The next run finds the server gone and leaves the script to spawn
+    assert fork_server.run([str(script)], timeout=10) is None
+
+
+def test_preloaded_random_state_is_reseeded(numpy_fork_server, tmp_path, monkeypatch):
+    script = tmp_path / "draw.py"
+    script.write_text("import random\nimport numpy\nprint(numpy.random.state, random.random())\n")
+    monkeypatch.chdir(tmp_path)
+    outputs = [numpy_fork_server.run([script.name], timeout=10)["output"] for _ in range(2)]
+    assert outputs[0] != outputs[1]
+    assert len(set(outputs[0].split() + outputs[1].split())) == 4
+
+
+def test_tracebacks_show_the_absolute_path(fork_server, tmp_path, monkeypatch):
+    (tmp_path / "fail.py").write_text("raise ValueError('boom')\n")
+    monkeypatch.chdir(tmp_path)
+    result = fork_server.run(["fail.py"], timeout=10)
+    assert result["exit_code"] == 1
+    assert f'File "{tmp_path / "fail.py"}", line 1' in result["error"]
+
+
+def test_socket_is_private(fork_server):
+    assert os.stat(functions.FORKSERVER_DIR).st_mode & 0o077 == 0
+    assert os.stat(fork_server.socket_path).st_mode & 0o077 == 0
@@ -0,0 +1,111 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import functions
+
+ARTICLE = "<p>" + "Static documentation text that is long enough to read. " * 20 + "</p>"
+PAGES = {
+    "/static": ("text/html", f"<html><body><main>{ARTICLE}<a href='/next'>next</a></main></body></html>"),
+    "/app": ("text/html", "<html><body><div id='root'></div><script src='app.js'></script></body></html>"),
+    "/data.json": ("application/json", json.dumps({"answer": 42})),
+    "/logo.png": ("image/png", "not really a png"),
+}
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        if self.path not in PAGES:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content_type, body = PAGES[self.path]
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    httpd.clients = set()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_session(monkeypatch):
+    monkeypatch.setattr(functions, "http_session", None)
+
+
+def test_static_page_is_fetched_without_a_browser(server):
+    _, base = server
+    page = functions.fetch_with_http(f"{base}/static")
+    assert "Static documentation text" in page["text"]
+    assert page["links"] == [f"{base}/next"]
+    assert page["etag"] == '"v1"'
+
+
+def test_script_rendered_page_is_left_to_the_browser(server):
+    _, base = server
+    assert functions.fetch_with_http(f"{base}/app") is None
+
+
+def test_json_is_returned_as_text(server):
+    _, base = server
+    assert json.loads(functions.fetch_with_http(f"{base}/data.json")["text"]) == {"answer": 42}
+
+
+def test_binary_and_missing_pages_are_left_to_the_browser(server):
+    _, base = server
+    assert functions.fetch_with_http(f"{base}/logo.png") is None
+    assert functions.fetch_with_http(f"{base}/missing") is None
+
+
+def test_connection_is_reused(server):
+    httpd, base = server
+    for _ in range(3):
+        functions.fetch_with_http(f"{base}/static")
+    assert len(httpd.clients) == 1
+
+
+def test_fetch_page_falls_back_to_the_browser(server, monkeypatch, tmp_path):
+    _, base = server
+    monkeypatch.setattr(functions, "url_cache", functions.UrlCache(str(tmp_path / "cache.sqlite3")))
+    browser_urls = []
+
+    def fetch_with_browser(url):
+        browser_urls.append(url)
+        return {"text": "rendered", "links": [], "etag": None, "last_modified": None}
+
+    monkeypatch.setattr(functions, "fetch_with_browser", fetch_with_browser)
+    assert functions.fetch_page(f"{base}/static")["fetch_method"] == "http"
+    page = functions.fetch_page(f"{base}/app")
+    assert (page["fetch_method"], page["text"]) == ("browser", "rendered")
+    assert browser_urls == [f"{base}/app"]
+
+
+def test_cache_counts_fetches_from_many_threads(server, monkeypatch, tmp_path):
+    _, base = server
+    monkeypatch.setattr(functions, "url_cache", functions.UrlCache(str(tmp_path / "cache.sqlite3")))
+    functions.fetch_page(f"{base}/static")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        pages = list(executor.map(functions.fetch_page, [f"{base}/static"] * 40))
+    assert {page["cache"] for page in pages} == {"hit"}
+    assert functions.url_cache.stats() == {"hits": 40, "misses": 1, "revalidations": 0, "evictions": 0}
@@ -0,0 +1,124 @@
+import os
+import stat
+import textwrap
+
+import pytest
+
+import functions
+
+# Prints the prompts of `netlify deploy` for a site that is not linked yet,
+# records the answers it reads and each run in the current directory
+UNLINKED_NETLIFY = """\
+#!/bin/sh
+echo run >> netlify-runs.log
+printf '? What would you like to do? (Use arrow keys)\\n'
+read choice
+printf '%s\\n' "$choice" >> netlify-answers.log
+printf '? Team: DevinTC\\n'
+read team
+printf '%s\\n' "$team" >> netlify-answers.log
+printf '? Site name (leave blank for a random name; you can change it later): '
+read name
+printf '%s\\n' "$name" >> netlify-answers.log
+echo 'Deploying to main site URL...'
+echo 'Website URL:       https://example.netlify.app'
+"""
+LINKED_NETLIFY = """\
+#!/bin/sh
+echo run >> netlify-runs.log
+echo 'Deploying to main site URL...'
+echo 'Website URL:       https://linked.netlify.app'
+"""
+HANGING_NETLIFY = """\
+#!/bin/sh
+echo 'Logging in...'
+sleep 30
+"""
+
+
+@pytest.fixture
+def fake_netlify(tmp_path, monkeypatch):
+    # Puts a netlify script with the given body first on PATH
+    bin_directory = tmp_path / "bin"
+    bin_directory.mkdir()
+    monkeypatch.setenv("PATH", f"{bin_directory}{os.pathsep}{os.environ['PATH']}")
+
+    def install(script):
+        netlify = bin_directory / "netlify"
+        netlify.write_text(textwrap.dedent(script))
+        netlify.chmod(netlify.stat().st_mode | stat.S_IXUSR)
+
+    return install
+
+
+@pytest.fixture
+def app_directory(tmp_path, monkeypatch):
+    # A React app whose build only copies its sources
+    app = tmp_path / "my-app"
+    (app / "src").mkdir(parents=True)
+    (app / "src" / "App.js").write_text("export default () => null;\n")
+    (app / "package.json").write_text("{}\n")
+
+    def build_app(app_directory):
+        build = os.path.join(app_directory, "build")
+        os.makedirs(build, exist_ok=True)
+        with open(os.path.join(app_directory, "src", "App.js")) as source, open(f"{build}/main.js", "w") as target:
+            target.write(source.read())
+        return None
+
+    monkeypatch.setattr(functions, "build_app", build_app)
+    return app
+
+
+def test_prompts_are_answered_as_they_appear(fake_netlify, tmp_path):
+    fake_netlify(UNLINKED_NETLIFY)
+    process = functions.InteractiveProcess(["netlify", "deploy"], cwd=tmp_path)
+    timings = process.interact(functions.NETLIFY_PROMPTS, idle_timeout=10)
+    assert process.wait() == 0
+    assert list(timings) == ["site_choice", "team", "site_name", "finish"]
+    assert "https://example.netlify.app" in process.output()
+    # The arrow key moves to "Create & configure a new site"; the rest take the defaults
+    answers = (tmp_path / "netlify-answers.log").read_text().splitlines()
+    assert answers == ["\x1b[B", "", ""]
+
+
+def test_linked_site_is_deployed_without_prompts(fake_netlify, tmp_path):
+    fake_netlify(LINKED_NETLIFY)
+    process = functions.InteractiveProcess(["netlify", "deploy"], cwd=tmp_path)
+    timings = process.interact(functions.NETLIFY_PROMPTS, idle_timeout=10)
+    assert process.wait() == 0
+    assert list(timings) == ["finish"]
+    assert "https://linked.netlify.app" in process.output()
+
+
+def test_silent_command_times_out(fake_netlify, tmp_path):
+    fake_netlify(HANGING_NETLIFY)
+    process = functions.InteractiveProcess(["netlify", "deploy"], cwd=tmp_path)
+    with pytest.raises(TimeoutError):
+        process.interact(functions.NETLIFY_PROMPTS, idle_timeout=0.5)
+    process.kill()
+    assert process.wait() != 0
+    assert "Logging in..." in process.output()
+
+
+def test_unchanged_build_is_not_deployed_again(fake_netlify, app_directory):
+    fake_netlify(UNLINKED_NETLIFY)
+    first = functions.build_and_deploy(str(app_directory))
+    assert first["error"] == ""
+    assert first["returncode"] == 0
+    assert "https://example.netlify.app" in first["output"]
+    second = functions.build_and_deploy(str(app_directory))
+    assert second["build_skipped"]
+    assert second["output"] == first["output"]
+    assert "already up to date" in second["status"]
+    assert (app_directory / "netlify-runs.log").read_text().count("run") == 1
+
+
+def test_changed_build_is_deployed(fake_netlify, app_directory):
+    fake_netlify(LINKED_NETLIFY)
+    functions.build_and_deploy(str(app_directory))
+    (app_directory / "src" / "App.js").write_text("export default () => 'changed';\n")
+    result = functions.build_and_deploy(str(app_directory))
+    assert not result["build_skipped"]
+    assert result["changed_files"]["modified"] == ["build/main.js"]
+    assert (app_directory / "netlify-runs.log").read_text().count("run") == 2
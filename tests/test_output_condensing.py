@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+import functions
+
+
+@pytest.fixture(autouse=True)
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(functions, "TOOL_OUTPUT_DIR", str(tmp_path / "tool_outputs"))
+
+
+def expand(**args):
+    return json.loads(functions.expand_output(args))
+
+
+def test_pages_follow_the_shown_line_numbers():
+    handle = functions.store_tool_output("\n".join(f"row {number}" for number in range(1, 11)))
+    first = expand(handle=handle, line_count=3)
+    assert first["lines"] == "1: row 1\n2: row 2\n3: row 3"
+    second = expand(handle=handle, start_line=first["next_start_line"], line_count=3)
+    assert second["lines"].splitlines()[0] == "4: row 4"
+
+
+def test_matching_lines_page_by_line_number():
+    rows = [f"row {number} {'error' if number % 3 == 0 else 'ok'}" for number in range(1, 31)]
+    handle = functions.store_tool_output("\n".join(rows))
+    first = expand(handle=handle, pattern="error", line_count=2, start_line=5)
+    assert first["lines"] == "6: row 6 error\n9: row 9 error"
+    second = expand(handle=handle, pattern="error", line_count=2, start_line=first["next_start_line"])
+    assert second["lines"] == "12: row 12 error\n15: row 15 error"
+
+
+def test_invalid_pattern_is_an_error():
+    handle = functions.store_tool_output("one\ntwo\n")
+    assert "Invalid regular expression" in expand(handle=handle, pattern="(")["error"]
+
+
+def test_single_line_text_keeps_its_start():
+    policy = {"max_tokens": 50, "head_lines": 0, "tail_lines": 0}
+    text = "Words about React hooks. " * 200
+    condensed = functions.condense_text(text, policy)
+    assert condensed.startswith("Words about React hooks.")
+    assert "Call expand_output with handle" in condensed